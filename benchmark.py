@@ -0,0 +1,453 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # headless, must be set before pygame is imported
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import sys
+import json
+import argparse
+import platform
+import numpy as np
+import pygame
+from time import perf_counter
+from pyaudio import paFloat32, paInputOverflow
+import spectrumtool as st
+
+# Benchmarks for SpectrumTool
+#
+# Times the effects, analysis and drawing functions on their own and a whole ui frame end to end,
+# without a sound card or a window: audio comes from FakePyAudio below and pygame uses the dummy video driver.
+# Results can be saved as a baseline and later runs are compared against it to catch regressions.
+#
+# Usage ------------------------------------------------------------
+# - 'py benchmark.py' to run everything and compare against benchmark_baseline.json if it exists
+# - 'py benchmark.py --save-baseline' to store this run as the new baseline
+# - 'py benchmark.py --filter renderer' to only run benchmarks whose name contains 'renderer'
+# - 'py benchmark.py --wav input.wav --xrun-every 50' to feed the frame and stream benchmarks a file and report xruns
+# Baselines are only comparable on the machine that recorded them.
+
+# ---------------------------- CONFIG ---------------------------- #
+WIDTHS = (800, 1920, 3840) # window widths
+HEIGHT = 500
+FFT_SIZES = (1024, 4096, 16384)
+DECAYS = (1, 4, 8)
+PANES = (1, 4, 9) # monitor window panes
+STREAMS = ((44100, 1, "int16"), (48000, 2, "float32"), (96000, 2, "int24"), (192000, 2, "int24"), (192000, 8, "float32")) # rate, channels, format
+SOURCE = "chirp" # fake input of the frame and stream benchmarks: "sine", "noise" or "chirp"
+WAV = None # .wav file played instead of SOURCE
+XRUN_EVERY = 0 # blocks between input overflows reported to the frame and stream benchmarks (0 = never)
+MIN_TIME = 0.2 # seconds each repeat runs for
+REPEATS = 3 # best of
+THRESHOLD = 0.2 # slower than the baseline by more than this fraction counts as a regression
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# ---------------------------- FAKE AUDIO ---------------------------- #
+# signal sources, read(n) returns the next n samples in [-1, 1] and keeps going from there
+class Sine:
+	def __init__(self, freq=440, amplitude=0.5, rate=st.RATE):
+		self.step = 2 * np.pi * freq / rate
+		self.amplitude = amplitude
+		self.position = 0
+
+	def read(self, n):
+		samples = self.amplitude * np.sin(self.step * np.arange(self.position, self.position + n))
+		self.position += n
+		return samples
+
+class Noise:
+	def __init__(self, amplitude=0.5, seed=0):
+		self.amplitude = amplitude
+		self.rng = np.random.default_rng(seed)
+
+	def read(self, n):
+		return self.rng.uniform(-self.amplitude, self.amplitude, n)
+
+# exponential sweep from f0 to f1 over seconds, then starts again
+class Chirp:
+	def __init__(self, f0=20, f1=20000, seconds=5, amplitude=0.5, rate=st.RATE):
+		self.length = int(seconds * rate)
+		k = np.log(f1 / f0) / self.length
+		t = np.arange(self.length)
+		self.samples = amplitude * np.sin(2 * np.pi * f0 / rate * np.expm1(k * t) / k)
+		self.position = 0
+
+	def read(self, n):
+		index = np.arange(self.position, self.position + n) % self.length
+		self.position = (self.position + n) % self.length
+		return self.samples[index]
+
+# plays a .wav file (first channel) on a loop, scaled to [-1, 1] like batch mode reads it
+class WavFile:
+	def __init__(self, filename):
+		self.rate, data = st.read_wav(filename)
+		self.samples = st.to_float(data[:, 0] if data.ndim > 1 else data)
+		self.position = 0
+
+	def read(self, n):
+		index = np.arange(self.position, self.position + n) % len(self.samples)
+		self.position = (self.position + n) % len(self.samples)
+		return self.samples[index]
+
+# plays (source, seconds) pairs one after the other, on a loop
+class Script:
+	def __init__(self, steps, rate=st.RATE):
+		self.steps = [(source, int(seconds * rate)) for source, seconds in steps]
+		self.step = 0
+		self.left = self.steps[0][1]
+
+	def read(self, n):
+		out = np.empty(n)
+		done = 0
+		while done < n:
+			source, length = self.steps[self.step]
+			take = min(self.left, n - done)
+			out[done:done + take] = source.read(take)
+			done += take
+			self.left -= take
+			if self.left == 0:
+				self.step = (self.step + 1) % len(self.steps)
+				self.left = self.steps[self.step][1]
+		return out
+
+# stands in for pyaudio.PyAudio, streams read from source instead of a device
+# callback streams don't run on their own thread, pump() calls the callback so runs are repeatable
+class FakePyAudio:
+	def __init__(self, source=None, xrun_every=0):
+		self.source = source or Sine()
+		self.xrun_every = xrun_every # report an input overflow every this many blocks (0 = never)
+		self.streams = []
+
+	def open(self, format=paFloat32, channels=1, rate=st.RATE, input=False, output=False, frames_per_buffer=st.BUFFER, stream_callback=None, **kwargs):
+		stream = FakeStream(self, format, channels, frames_per_buffer, stream_callback)
+		self.streams.append(stream)
+		return stream
+
+	def terminate(self):
+		for stream in self.streams:
+			stream.close()
+		self.streams = []
+
+class FakeStream:
+	def __init__(self, pyaudio, format, channels, frames_per_buffer, callback):
+		formats = {pa_format: name for name, pa_format in st.PA_FORMATS.items()}
+		if format not in formats:
+			raise ValueError(f"FakeStream only supports {', '.join(st.PA_FORMATS)}")
+		self.pyaudio = pyaudio
+		self.format = formats[format]
+		self.channels = channels
+		self.frames_per_buffer = frames_per_buffer
+		self.callback = callback
+		self.active = False
+		self.blocks = 0
+		self.output = None # last block written or returned by the callback
+
+	def encode(self, samples):
+		# the same samples in every channel
+		return st.encode_samples(np.broadcast_to(samples, (self.channels, len(samples))), self.format)
+
+	def read(self, frames, exception_on_overflow=True):
+		self.blocks += 1
+		return self.encode(self.pyaudio.source.read(frames))
+
+	def write(self, data):
+		self.output = data
+
+	def pump(self, blocks=1):
+		for _ in range(blocks):
+			self.blocks += 1
+			xrun = self.pyaudio.xrun_every and self.blocks % self.pyaudio.xrun_every == 0
+			in_data = self.encode(self.pyaudio.source.read(self.frames_per_buffer))
+			self.output, _ = self.callback(in_data, self.frames_per_buffer, {}, paInputOverflow if xrun else 0)
+
+	def start_stream(self):
+		self.active = True
+
+	def stop_stream(self):
+		self.active = False
+
+	def is_active(self):
+		return self.active
+
+	def close(self):
+		self.active = False
+
+# ---------------------------- TIMING ---------------------------- #
+def measure(fn, min_time=MIN_TIME, repeats=REPEATS):
+	# seconds per call, best of repeats runs that each last at least min_time
+	fn() # warm up (jit compile, caches)
+	number = 1
+	while True:
+		start = perf_counter()
+		for _ in range(number):
+			fn()
+		elapsed = perf_counter() - start
+		if elapsed >= min_time:
+			break
+		number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+	best = elapsed / number
+	for _ in range(repeats - 1):
+		start = perf_counter()
+		for _ in range(number):
+			fn()
+		best = min(best, (perf_counter() - start) / number)
+	return best
+
+def make_source(rate=st.RATE):
+	# input of the frame and stream benchmarks, see SOURCE and WAV, chirps sweep to just under half the rate
+	if WAV:
+		return WavFile(WAV)
+	if SOURCE == "sine":
+		return Sine(rate=rate)
+	if SOURCE == "noise":
+		return Noise()
+	return Chirp(f1=rate / 2.2, rate=rate)
+
+def source_params():
+	# appended to the names of the benchmarks make_source feeds, so they are never compared to a chirp baseline
+	params = f",wav={os.path.basename(WAV)}" if WAV else (f",source={SOURCE}" if SOURCE != "chirp" else "")
+	return params + (f",xrun_every={XRUN_EVERY}" if XRUN_EVERY else "")
+
+def block(source=None, sample_format=st.SAMPLE_FORMAT):
+	return st.encode_samples((source or Sine()).read(st.BUFFER), sample_format)
+
+def scale_spectrum(dp_spectrum, spectrum_h_range):
+	# same dB to pixel scaling as the main loop, in place
+	dp_spectrum -= st.MIN_DB
+	dp_spectrum /= -st.MIN_DB
+	np.clip(dp_spectrum, 0, 1, out=dp_spectrum)
+	dp_spectrum *= spectrum_h_range * 0.95
+	return dp_spectrum
+
+def filled_renderer(width, decay):
+	# decay history filled with analysed noise, so lines are as busy as with a live input
+	renderer = st.SpectrumRenderer(width, HEIGHT, decay=decay)
+	ring = st.RingBuffer(2 * st.FFT_SIZE, dtype=np.float32)
+	noise = Noise()
+	analyzer = st.SpectrumAnalyzer()
+	axis = st.FrequencyAxis(width, analyzer.n_bins)
+	for _ in range(decay):
+		ring.write(noise.read(analyzer.hop))
+		analyzer.update(ring)
+		scale_spectrum(axis.map(analyzer.db, out=renderer.advance()), HEIGHT - st.UNIT)
+	return renderer
+
+# ---------------------------- BENCHMARKS ---------------------------- #
+# each yields (name, fn) pairs, fn is timed before the next one is set up and the name carries the parameters
+def bench_effects():
+	buffer = Noise().read(st.BUFFER).astype(np.float32)
+	yield "dist_gain_fx", lambda: st.dist_gain_fx(buffer, 64, 0.8)
+	shifter = st.FrequencyShifter(hz=st.shift_to_hz(st.SHIFT_MAX/2 + 8))
+	yield "FrequencyShifter.process", lambda: shifter.process(buffer)
+	chain = st.EffectsChain()
+	chain.dist_gain.amount = 64
+	chain.shifter.set_shift(st.shift_to_hz(st.SHIFT_MAX/2 + 8))
+	in_data = block(Noise())
+	yield "EffectsChain.process", lambda: chain.process(in_data)
+
+def bench_analysis():
+	for fft_size in FFT_SIZES:
+		ring = st.RingBuffer(2 * fft_size, dtype=np.float32)
+		ring.write(Noise().read(2 * fft_size))
+		analyzer = st.SpectrumAnalyzer(fft_size=fft_size)
+		def update():
+			analyzer.position = -analyzer.hop # always due for a frame
+			analyzer.update(ring)
+		yield f"SpectrumAnalyzer.update[fft={fft_size}]", update
+	for width in WIDTHS:
+		yield f"create_log_scale[width={width}]", lambda: st.create_log_scale(width)
+		spectrum = np.random.default_rng(0).uniform(st.MIN_DB, 0, st.FFT_SIZE // 2 + 1)
+		for mode in ("interp", "max"):
+			axis = st.FrequencyAxis(width, len(spectrum), mode=mode)
+			out = np.empty(width)
+			yield f"FrequencyAxis.map[width={width},mode={mode}]", lambda: axis.map(spectrum, out=out)
+	for fft_size in FFT_SIZES:
+		analyzer = st.SpectrumAnalyzer(fft_size=fft_size)
+		ring = st.RingBuffer(2 * fft_size, dtype=np.float32)
+		ring.write(Script([(Sine(220, 0.3), 1), (Noise(0.01), 1)]).read(2 * fft_size))
+		analyzer.update(ring)
+		for mode in ("peak", "hps", "autocorr"):
+			tracker = st.PeakTracker(analyzer, mode=mode)
+			yield f"PeakTracker.update[fft={fft_size},mode={mode}]", lambda: tracker.update(analyzer.db)
+	analyzer = st.SpectrumAnalyzer()
+	publisher = st.SpectrumPublisher(analyzer, name="spectrumtool-benchmark", udp=("127.0.0.1", 9))
+	yield f"SpectrumPublisher.publish[fft={analyzer.fft_size}]", lambda: publisher.publish(analyzer.db, 440, "A4", 0)
+	publisher.close()
+	yield "note_equivalent", lambda: st.note_equivalent(440)
+	freqs = st.create_log_scale(WIDTHS[0])
+	yield f"note_names[n={len(freqs)}]", lambda: st.note_names(freqs)
+
+def bench_drawing():
+	for width in WIDTHS:
+		screen = pygame.display.set_mode((width, HEIGHT))
+		for decay in DECAYS:
+			renderer = filled_renderer(width, decay)
+			for solid in (False, True):
+				view = "solid" if solid else "line"
+				yield f"SpectrumRenderer.draw[width={width},decay={decay},view={view}]", lambda: renderer.draw(screen, HEIGHT - st.UNIT, solid=solid)
+		waterfall = st.Waterfall(width, int(HEIGHT - st.UNIT))
+		levels = filled_renderer(width, 1).latest()
+		def waterfall_frame():
+			waterfall.push(levels, (HEIGHT - st.UNIT) * 0.95)
+			waterfall.draw(screen)
+		yield f"Waterfall.push+draw[width={width}]", waterfall_frame
+	screen = pygame.display.set_mode((WIDTHS[0], HEIGHT))
+	controls = [st.Button("LINE", True), st.Button("MIC", True), st.Button("MUTE", False), st.Button("FREEZE", False), st.Button("REC", False),
+		st.Knob(0, st.SHIFT_MAX, "SHIFT", st.SHIFT_MAX/2, percent=False), st.Knob(1, 512, "DIST", 1), st.Knob(0, 1.2, "GAIN", 0.8)]
+	def draw_controls():
+		for i, control in enumerate(controls):
+			control.draw(screen, st.UNIT/2 + i * st.UNIT, HEIGHT - st.UNIT/2, st.UNIT/3)
+	yield "controls.draw", draw_controls
+	yield "draw_text", lambda: st.draw_text(screen, "440 Hz", st.FONT_SMALL, 100, 100)
+
+	# monitor window front end, fed by publishers in this process instead of workers, every pane gets a new frame each time
+	screen = pygame.display.set_mode((WIDTHS[1], 2 * HEIGHT))
+	analyzer = st.SpectrumAnalyzer()
+	ring = st.RingBuffer(2 * analyzer.fft_size, dtype=np.float32)
+	ring.write(Noise().read(2 * analyzer.fft_size))
+	analyzer.update(ring)
+	for n_panes in PANES:
+		publishers, panes = [], []
+		for i, rect in enumerate(st.monitor_layout(n_panes, *screen.get_size(), "tiled")):
+			name = f"spectrumtool-benchmark-{i}"
+			publishers.append(st.SpectrumPublisher(analyzer, name))
+			pane = st.MonitorPane(i, i, None, name, [1, 0, 1, st.SHIFT_MAX/2, 0.8, 1, 0])
+			pane.layout(rect)
+			panes.append(pane)
+		def monitor_frame():
+			for publisher, pane in zip(publishers, panes):
+				publisher.publish(analyzer.db, 440, "A4", 0)
+				pane.poll(0)
+				pane.draw(screen, False, "")
+			pygame.display.update([pane.rect for pane in panes])
+		yield f"MonitorPane.poll+draw[width={WIDTHS[1]},panes={n_panes}]", monitor_frame
+		for pane in panes:
+			if pane.reader is not None: # only attached once polled, not when --filter skipped the benchmark
+				pane.reader.close()
+		for publisher in publishers:
+			publisher.close()
+
+def bench_frames():
+	# one ui frame per audio block: callback, analysis, axis mapping and, when there is a new frame, drawing and the display update
+	# frozen frames replay the same block with the knobs untouched, as while FREEZE is held or the mic is off
+	for width in WIDTHS:
+		screen = pygame.display.set_mode((width, HEIGHT))
+		static_layer = pygame.Surface((width, HEIGHT))
+		static_layer.fill(st.BACKGROUND_COLOR)
+		spectrum_h_range = HEIGHT - st.UNIT
+		spectrum_rect = pygame.Rect(0, 0, width, spectrum_h_range)
+		cases = [(fft_size, decay, False) for fft_size in FFT_SIZES for decay in DECAYS] + [(st.FFT_SIZE, st.DECAY, True)]
+		for fft_size, decay, frozen in cases:
+			engine = st.AudioEngine(ring_size=max(st.RING_SIZE, 2 * fft_size // st.BUFFER), backend=lambda: FakePyAudio(make_source(), XRUN_EVERY))
+			engine.start()
+			engine.freeze = frozen
+			analyzer = st.SpectrumAnalyzer(fft_size=fft_size)
+			axis = st.FrequencyAxis(width, analyzer.n_bins)
+			renderer = st.SpectrumRenderer(width, HEIGHT, decay=decay)
+			def frame():
+				engine.stream.pump()
+				if analyzer.update(engine.ring, engine.shifter):
+					scale_spectrum(axis.map(analyzer.db, out=renderer.advance()), spectrum_h_range)
+					screen.set_clip(spectrum_rect)
+					screen.blit(static_layer, (0, 0))
+					renderer.draw(screen, spectrum_h_range)
+					screen.set_clip(None)
+					pygame.display.update([spectrum_rect])
+			for _ in range(engine.settle_blocks): # past the first frames, so frozen runs are settled
+				frame()
+			yield f"frame[width={width},fft={fft_size},decay={decay}{',frozen' if frozen else ''}{source_params()}]", frame
+			engine.close()
+
+def bench_streams():
+	# audio callback with the shifter on and one analysed frame per block, at the rates, channel counts and formats of real interfaces
+	# budget is how long one block lasts, the callback and analysis have to fit in it on one core to keep up
+	for rate, channels, sample_format in STREAMS:
+		engine = st.AudioEngine(rate, st.BUFFER, channels, sample_format, backend=lambda: FakePyAudio(make_source(rate), XRUN_EVERY))
+		engine.start()
+		engine.shift = st.SHIFT_MAX/2 + 8
+		engine.dist = 64
+		analyzer = st.SpectrumAnalyzer(rate=rate, channels=channels)
+		def stream():
+			engine.stream.pump()
+			analyzer.update(engine.ring, engine.shifter)
+		params = f"rate={rate},channels={channels},format={sample_format}"
+		yield f"stream[{params},budget={st.BUFFER / rate * 1e6:.0f}us{source_params()}]", stream
+		engine.close()
+		ring = st.RingBuffer(2 * st.FFT_SIZE, dtype=np.float32, channels=channels)
+		ring.write(Noise().read(2 * st.FFT_SIZE))
+		def update():
+			analyzer.position = -analyzer.hop # always due for a frame
+			analyzer.update(ring)
+		yield f"SpectrumAnalyzer.update[fft={st.FFT_SIZE},{params}]", update
+		in_data = st.encode_samples(np.broadcast_to(Noise().read(st.BUFFER), (channels, st.BUFFER)), sample_format)
+		out = np.zeros((channels, st.BUFFER), dtype=np.float32)
+		yield f"decode_samples[{params}]", lambda: st.decode_samples(in_data, sample_format, out)
+		yield f"encode_samples[{params}]", lambda: st.encode_samples(out, sample_format)
+
+BENCHMARKS = (bench_effects, bench_analysis, bench_streams, bench_drawing, bench_frames)
+
+# ---------------------------- REPORT ---------------------------- #
+def load_baseline(filename):
+	if not os.path.exists(filename):
+		return {}
+	with open(filename) as f:
+		return json.load(f)["results"]
+
+def save_baseline(filename, results):
+	with open(filename, "w") as f:
+		json.dump({"machine": platform.platform(), "python": platform.python_version(), "numpy": np.__version__, "results": results}, f, indent=1, sort_keys=True)
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmarks for SpectrumTool, run headless against a fake audio device.")
+	parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+	parser.add_argument("--baseline", default=BASELINE, help="baseline file to compare against")
+	parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+	parser.add_argument("--threshold", type=float, default=THRESHOLD, help="fraction slower than the baseline that counts as a regression")
+	parser.add_argument("--min-time", type=float, default=MIN_TIME, help="seconds each timing repeat runs for")
+	parser.add_argument("--json", default=None, help="also write the results to this file")
+	parser.add_argument("--source", choices=("sine", "noise", "chirp"), default=SOURCE, help=f"fake input of the frame and stream benchmarks (default: {SOURCE})")
+	parser.add_argument("--wav", metavar="FILE", default=WAV, help="play this .wav file (first channel, on a loop) instead of --source")
+	parser.add_argument("--xrun-every", metavar="BLOCKS", type=int, default=XRUN_EVERY, help="report an input overflow every this many blocks in the frame and stream benchmarks (default: never)")
+	args = parser.parse_args(argv)
+	if args.wav and not os.path.isfile(args.wav):
+		parser.error(f"input file '{args.wav}' not found")
+	if args.xrun_every < 0:
+		parser.error(f"--xrun-every can't be negative, got {args.xrun_every}")
+	return args
+
+def main(argv=None):
+	global SOURCE, WAV, XRUN_EVERY
+	args = parse_args(argv)
+	SOURCE, WAV, XRUN_EVERY = args.source, args.wav, args.xrun_every # read by make_source and the fake streams
+	pygame.init()
+	baseline = {} if args.save_baseline else load_baseline(args.baseline)
+	results = {}
+	regressions = []
+	print(f"{'benchmark':<80}{'us/call':>12}{'per sec':>12}{'baseline':>10}")
+	for bench in BENCHMARKS:
+		for name, fn in bench():
+			if args.filter not in name:
+				continue
+			seconds = results[name] = measure(fn, args.min_time)
+			change = ""
+			if name in baseline:
+				ratio = seconds / baseline[name] - 1
+				change = f"{ratio:+.0%}"
+				if ratio > args.threshold:
+					regressions.append(name)
+					change += " !"
+			print(f"{name:<80}{seconds * 1e6:>12.1f}{1 / seconds:>12.0f}{change:>10}")
+	pygame.quit()
+
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+	if args.save_baseline:
+		save_baseline(args.baseline, results)
+		print(f"baseline saved to {args.baseline}")
+	if regressions:
+		print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,160 @@
+import sys
+import socket
+import argparse
+import numpy as np
+from time import sleep
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker
+
+# Reader for the spectra published by SpectrumTool (run it with --publish, --publish-udp or --publish-unix)
+#
+# Only needs numpy, so loggers, alerting or a dashboard can read the live spectra without opening the mic or
+# redoing the FFTs. SpectrumTool imports the layout below from here, so both sides always agree on it.
+#
+# Shared memory ------------------------------------------------------
+# A header followed by a ring of slots, one frame per slot. Each slot holds its frame's sequence number,
+# which is cleared while the slot is being written, and the header holds the newest sequence number.
+# SpectrumReader hands out views straight into the ring (no copies). A frame is only safe to use while
+# reader.valid(frame) is True, since a slow reader gets overwritten rather than ever slowing the writer.
+#
+#	reader = SpectrumReader()
+#	for frame in reader.frames():
+#		print(frame.seq, frame.peak_freq, frame.note, reader.freqs[frame.spectrum.argmax()])
+#
+# Stream --------------------------------------------------------------
+# One datagram per frame: a PACKET_DTYPE header then the spectrum as float16. Datagrams are dropped rather
+# than queued when no one is listening or the reader falls behind.
+#
+#	for frame in StreamReader(port=9797).frames():
+#		print(frame.seq, frame.peak_freq, frame.note)
+
+# ---------------------------- LAYOUT ---------------------------- #
+MAGIC = b"SPEC"
+VERSION = 1
+SHM_NAME = "spectrumtool" # default shared memory name
+UDP_PORT = 9797 # default stream port
+SLOTS = 64 # frames kept in the shared memory ring
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([("magic", "S4"), ("version", "<u4"), ("n_bins", "<u4"), ("slots", "<u4"), ("fft_size", "<u4"), ("rate", "<f8"), ("seq", "<u8")], align=True)
+PACKET_DTYPE = np.dtype([("magic", "S4"), ("n_bins", "<u4"), ("seq", "<u8"), ("timestamp", "<f8"), ("peak_freq", "<f8"), ("note", "S8")])
+
+def slot_dtype(n_bins):
+	# seq, timestamp, peak frequency (hz, 0 when quiet), note name and the spectrum in dBFS, padded so every slot is 8 byte aligned
+	size = 32 + 4 * n_bins
+	return np.dtype({
+		"names": ["seq", "timestamp", "peak_freq", "note", "spectrum"],
+		"formats": ["<u8", "<f8", "<f8", "S8", ("<f4", (n_bins,))],
+		"offsets": [0, 8, 16, 24, 32],
+		"itemsize": size + -size % 8,
+	})
+
+def shm_size(n_bins, slots=SLOTS):
+	return HEADER_SIZE + slots * slot_dtype(n_bins).itemsize
+
+# seq, unix time, peak frequency, note name and the spectrum (dBFS, one value per fft bin)
+Frame = namedtuple("Frame", ("seq", "timestamp", "peak_freq", "note", "spectrum"))
+
+# ---------------------------- READERS ---------------------------- #
+def attach(name, spawned=False):
+	# attaching must not make this process unlink the memory when it exits, that is up to the publisher
+	# spawned is True when the publisher runs in a multiprocessing child of this process, they share a resource
+	# tracker then, so the publisher's own registration must be left alone
+	try:
+		return shared_memory.SharedMemory(name=name, track=False)
+	except TypeError: # python < 3.13 has no track argument
+		shm = shared_memory.SharedMemory(name=name)
+		if sys.platform != "win32" and not spawned:
+			resource_tracker.unregister(shm._name, "shared_memory")
+		return shm
+
+class SpectrumReader:
+	def __init__(self, name=SHM_NAME, spawned=False):
+		self.shm = attach(name, spawned)
+		self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+		if self.header["magic"] != MAGIC or self.header["version"] != VERSION:
+			self.close()
+			raise ValueError(f"'{name}' is not a SpectrumTool version {VERSION} spectrum ring")
+		self.n_bins = int(self.header["n_bins"])
+		self.fft_size = int(self.header["fft_size"])
+		self.rate = float(self.header["rate"])
+		self.freqs = np.fft.rfftfreq(self.fft_size, 1 / self.rate) # frequency of each spectrum bin
+		self.slots = np.ndarray((int(self.header["slots"]),), dtype=slot_dtype(self.n_bins), buffer=self.shm.buf, offset=HEADER_SIZE)
+
+	def newest(self):
+		return int(self.header["seq"])
+
+	def get(self, seq):
+		# the frame with this sequence number, or None if it isn't in the ring (not written yet or overwritten)
+		i = seq % len(self.slots)
+		slots = self.slots
+		if seq == 0 or slots["seq"][i] != seq:
+			return None
+		frame = Frame(seq, float(slots["timestamp"][i]), float(slots["peak_freq"][i]), slots["note"][i].decode(), slots["spectrum"][i])
+		return frame if self.valid(frame) else None
+
+	def latest(self):
+		return self.get(self.newest())
+
+	def valid(self, frame):
+		# False once the frame's slot is being rewritten, check after using the spectrum view
+		return self.slots["seq"][frame.seq % len(self.slots)] == frame.seq
+
+	def frames(self, poll=0.005):
+		# every new frame from now on, frames that were overwritten before they were read are skipped
+		seq = self.newest()
+		while True:
+			newest = self.newest()
+			if newest == seq:
+				sleep(poll)
+				continue
+			seq = max(seq + 1, newest - len(self.slots) + 1)
+			frame = self.get(seq)
+			if frame is not None:
+				yield frame
+
+	def close(self):
+		self.header = self.slots = None # views must go before the memory can be closed
+		self.shm.close()
+
+class StreamReader:
+	def __init__(self, host="127.0.0.1", port=UDP_PORT, path=None):
+		# listens on a udp port, or on a unix datagram socket at path
+		if path is not None:
+			self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+			self.socket.bind(path)
+		else:
+			self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			self.socket.bind((host, port))
+
+	def recv(self):
+		data = self.socket.recv(65536)
+		header = np.frombuffer(data, dtype=PACKET_DTYPE, count=1)[0]
+		if header["magic"] != MAGIC:
+			raise ValueError("not a SpectrumTool packet")
+		spectrum = np.frombuffer(data, dtype="<f2", count=int(header["n_bins"]), offset=PACKET_DTYPE.itemsize).astype(np.float32)
+		return Frame(int(header["seq"]), float(header["timestamp"]), float(header["peak_freq"]), header["note"].decode(), spectrum)
+
+	def frames(self):
+		while True:
+			yield self.recv()
+
+	def close(self):
+		self.socket.close()
+
+# ---------------------------- MAIN ---------------------------- #
+# prints the peak of every frame, as an example reader
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Print the peak frequency and note of every frame SpectrumTool publishes.")
+	parser.add_argument("--name", default=SHM_NAME, help=f"shared memory name (default: {SHM_NAME})")
+	parser.add_argument("--udp", metavar="PORT", type=int, help="read the udp stream on this port instead")
+	parser.add_argument("--unix", metavar="PATH", help="read the unix socket stream at this path instead")
+	args = parser.parse_args()
+	if args.udp is not None or args.unix is not None:
+		reader = StreamReader(port=args.udp, path=args.unix)
+	else:
+		reader = SpectrumReader(args.name)
+	try:
+		for frame in reader.frames():
+			print(f"{frame.seq:>8} {frame.timestamp:.3f} {frame.peak_freq:>9.2f} Hz {frame.note:<4} max {frame.spectrum.max():6.1f} dBFS")
+	except KeyboardInterrupt:
+		reader.close()
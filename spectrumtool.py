@@ -1,13 +1,26 @@
-from pyaudio import PyAudio, paInt16
+from time import perf_counter_ns, time, sleep
+IMPORT_START = perf_counter_ns() # for --startup-profile
+from pyaudio import PyAudio, paInt16, paInt24, paInt32, paFloat32, paContinue, paInputOverflow, paInputUnderflow, paOutputOverflow, paOutputUnderflow
 import numpy as np
 import sys
+import argparse
+import configparser
 import pygame
-from os import path, makedirs
-from math import log, exp, floor
+from os import path, makedirs, environ, getpid
+import struct
+import json
+import threading
+from queue import Queue, Full
+from collections import OrderedDict
+from multiprocessing import Pool, freeze_support, get_context
+from math import log, log2, floor, ceil, sqrt
 from datetime import datetime
-from scipy.io.wavfile import write
-from numba import jit
 from pygame import gfxdraw
+import socket
+from multiprocessing import shared_memory
+from spectrumclient import MAGIC, VERSION, SHM_NAME, SLOTS, HEADER_SIZE, HEADER_DTYPE, PACKET_DTYPE, slot_dtype, shm_size, SpectrumReader
+IMPORT_END = perf_counter_ns()
+# scipy (batch mode only) and numba (first kernel call) are imported where they are needed, they are most of the import time
 
 # Created by Alec Ames
 # #6843577
@@ -19,6 +32,7 @@ from pygame import gfxdraw
 # Features ------------------------------------------------------
 # - Real-time frequency spectrum analyzer
 # - Solid and line spectrum view
+# - Scrolling waterfall (spectrogram) view
 # - Microphone on/off toggle
 # - Output mute/unmute toggle
 # - Spectrum freezing
@@ -28,16 +42,20 @@ from pygame import gfxdraw
 # - Keybind menu
 # - Dynamic UI resizing/rescaling
 # - Recording to .wav file (will create out/ folder if it doesn't exist)
+# - Any audio device, sample rate, bit depth and channel count (see --help or spectrumtool.ini)
+# - Monitoring several input devices at once, one process each (--devices)
 #
 # Keybinds & Controls ---------------------------------------------
 # Click and drag a knob to adjust its value OR Scroll with mouse wheel over a knob to adjust its value
 # Click on a button to toggle its state
 # - 'ESC' to quit
 # - 'V' to toggle between lines and solid spectrum view
+# - 'W' to toggle the scrolling waterfall (spectrogram) view
 # - 'N' to toggle microphone on/off
 # - 'M' to toggle mute/unmute
 # - 'F' to freeze the spectrum
 # - 'R' to record audio to .wav file
+# - 'P' to toggle the profiler overlay
 # - 'SHIFT' + Click to reset a knob to its default value
 # - 'CTRL' + Click to allow finer control of a knob
 # - Right click on FREEZE to toggle freeze mode (other parameters can be adjusted while frozen)
@@ -45,6 +63,11 @@ from pygame import gfxdraw
 # ---------------------------- CONFIG ---------------------------- #
 # ui settings
 FPS = 165
+ADAPTIVE_FPS = True # drop to IDLE_FPS while the window is not focused
+IDLE_FPS = 15
+SAVE_MESSAGE_FRAMES = 100 # frames the save message stays on screen
+PROFILE_WINDOW = 512 # timings kept per stage for the rolling percentiles
+PROFILE_REFRESH = 0.5 # seconds between profiler overlay updates
 TITLE = "SpectrumTool"
 FONT_COLOR = (255, 255, 255)
 FONT_COLOR_ACCENT = (200, 255, 200)
@@ -62,15 +85,56 @@ TIERTIARY_COLOR = (63, 74, 52)
 BACKGROUND_COLOR = (27, 27, 27)
 SPECTRUM_COLOR = (139, 178, 112)
 LINE_COLOR = (255, 255, 255, 12)
+TEXT_CACHE_SIZE = 256 # rendered text surfaces kept before the least recently used is dropped
+FONT_XTINY, FONT_TINY, FONT_SMALL, FONT_MEDIUM, FONT_LARGE = (round(SCALE * size) for size in (10, 12, 16, 20, 28))
+DECAY_ALPHA = 1.0 # opacity of each older spectrum relative to the one after it (1 = all solid)
 
 # audio settings
 DECAY = 4 # how many spectrums to draw
+WATERFALL_DEPTH = 0 # rows of waterfall history, one per analysed frame (0 = one per pixel of the spectrum area, fewer rows are drawn whole pixels taller)
+WATERFALL_COLORS = 256 # entries in the waterfall colour lookup table
 RATE = 44100 # sample rate
-BUFFER = 1024 # buffer size
-RESOLUTION = 44100 # resolution of the spectrum
-MIN_FREQ = 20 # min freq to display
-MAX_FREQ = RATE / 2 # max freq to display
-MIN_INT, MAX_INT = -32768, 32767 # int16 min and max
+BUFFER = 1024 # buffer size (power of two)
+CHANNELS = 1 # captured and played channels, each gets its own spectrum
+DEVICE = None # input device index, None is the system default (see --list-devices)
+OUTPUT_DEVICE = None # output device index, None is the system default
+SAMPLE_FORMAT = "float32" # stream sample format: "int16", "int24", "int32" or "float32", processing is always float32
+MONITOR_LAYOUT = "tiled" # panes with --devices: "tiled" (grid) or "stacked" (one column)
+MONITOR_STALL = 1.0 # seconds without an audio block before a pane shows its device as stalled
+MONITOR_JOIN = 1.0 # seconds a monitor worker gets to stop on exit before it is terminated
+CONFIG_FILE = "spectrumtool.ini" # audio settings read from beside the script when present, command line options override it
+FFT_SIZE = 4096 # analysis window length (power of two)
+WINDOW = "hann" # analysis window: "hann", "blackmanharris" or "flattop"
+OVERLAP = 0.75 # fraction of the analysis window shared by consecutive frames
+MIN_DB = -90 # level at the bottom of the display (dBFS)
+SHIFT_FFT_SIZE = FFT_SIZE # frequency shifter stft length, shares its transform with the display when equal to FFT_SIZE
+BATCH_CHUNK = 512 # buffers processed at a time in batch mode
+
+# recording settings
+RECORD_FORMAT = None # sample format of recorded .wav files: "int16", "int24", "int32" or "float32" (None = same as the stream)
+RECORD_QUEUE = 256 # blocks buffered between the audio callback and the writer thread
+RECORD_ROTATE_SECONDS = 0 # start a new file after this many seconds (0 = never)
+RECORD_ROTATE_BYTES = 0 # start a new file after this many bytes of audio (0 = only at WAV_MAX_BYTES)
+WAV_MAX_BYTES = 2 ** 32 - 1 - 64 # most audio a .wav header's 32 bit sizes can describe, recordings always rotate before it
+MIN_FREQ = 20 # min freq to display, the max is half the sample rate
+SAMPLE_FORMATS = {"int16": (2, 2 ** 15), "int24": (3, 2 ** 23), "int32": (4, 2 ** 31), "float32": (4, 0)} # bytes per sample and full scale (0 = float, full scale is 1)
+SHIFT_MAX = 48 # range of the frequency shift knob (in bins, centered)
+RING_SIZE = 16 # ring buffer length between audio callback and ui (in buffers)
+AXIS_MODE = "max" # how fft bins map to pixel columns: "interp", "max" or "mean"
+PITCH_MODE = "peak" # fundamental shown in the peak readout: "peak" (loudest peak), "hps" (harmonic product spectrum) or "autocorr"
+PEAK_COUNT = 3 # loudest peaks tracked
+PEAK_MIN_DB = -70 # quieter peaks are ignored (dBFS)
+PEAK_MIN_FREQ = 60 # lower peaks are ignored (hz)
+PEAK_SMOOTHING = 0.3 # fraction of each new pitch estimate mixed into the readout
+PEAK_JUMP = 100 # cents, bigger changes move the readout straight to the new pitch instead of gliding
+PEAK_HYSTERESIS = 20 # cents past the halfway point between notes before the note name changes
+PEAK_RELEASE = 8 # analysed frames without a peak before the readout goes idle
+HPS_HARMONICS = 4 # harmonics multiplied in hps mode
+HPS_RANGE = 30 # dB under the loudest peak a fundamental can be in hps mode (so a weak or missing fundamental is still found)
+AUTOCORR_MAX_FREQ = 2000 # highest fundamental found in autocorr mode (hz)
+AUTOCORR_RATIO = 0.9 # the shortest lag reaching this fraction of the best one wins, avoids octave errors
+LOWEST_NOTE = 21 # A0, midi notes below it have no name
+NOTE_NAMES = np.array([f"{('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')[n % 12]}{n // 12 - 1}" if n >= LOWEST_NOTE else "" for n in range(128)]) # midi note -> name
 
 # ---------------------------- CLASSES ---------------------------- #
 class Knob:
@@ -123,17 +187,19 @@ class Knob:
 			self.color = CTRL_IDLE
 			self.value_color = CTRL_IDLE
 
+	def state(self):
+		return (self.value, self.color, self.value_color)
+
 	def draw(self, screen, x, y, r):
 		x, y, r = int(x), int(y), int(r)
-		self.font_value = pygame.font.Font(FONT_PATH, round(SCALE*r/1.66))
-		self.font_label = pygame.font.Font(FONT_PATH, round(SCALE*r/3.33))
+		value_size, label_size = round(SCALE*r/1.66), round(SCALE*r/3.33)
 		self.rect = pygame.Rect(x - r, y - r, r * 2, r * 2)
 		self.angle_value = floor(135 + ((self.value - self.min) * 270 / (self.max - self.min)))
 		if self.percent:
-			text_rect = self.font_value.render(f"{int(((self.value - self.min)/((self.max - self.min))*100))}", True, self.value_color)
+			text_rect = text_cache.render(f"{int(((self.value - self.min)/((self.max - self.min))*100))}", value_size, self.value_color)
 		else:
-			text_rect = self.font_value.render(f"{int(self.value - shift_max/2)}", True, self.value_color)
-		label_rect_text = self.font_label.render(self.text, True, self.alt_color)
+			text_rect = text_cache.render(f"{int(self.value - SHIFT_MAX/2)}", value_size, self.value_color)
+		label_rect_text = text_cache.render(self.text, label_size, self.alt_color)
 		gfxdraw.arc(screen, x, y, r, 135, 405, self.alt_color)
 		gfxdraw.arc(screen, x, y, r, 135, self.angle_value, self.color)
 		screen.blit(label_rect_text, (x - (label_rect_text.get_width()/2), y + (r * 0.66)))
@@ -171,72 +237,198 @@ class Button:
 		self.color = self.color_map[self.value]
 		self.text = self.text_map[self.value]
 
+	def state(self):
+		return (self.value, self.color, self.text)
+
+	def set(self, value):
+		# for the program turning a button off, with the same look as a click
+		self.value = value
+		self.color = self.color_map[value]
+		self.text = self.text_map[value]
+
 	def draw(self, screen, x, y, r):
 		x,y,r = int(x), int(y), int(r)
-		self.font = pygame.font.Font(FONT_PATH, round(SCALE*r/2.5))
 		self.rect = pygame.Rect(x - r, y - r, r * 2, r * 2)
-		self.text_rect = self.font.render(self.text, True, self.color)
+		self.text_rect = text_cache.render(self.text, round(SCALE*r/2.5), self.color)
 		gfxdraw.aacircle(screen, x, y, r, self.color)
 		screen.blit(self.text_rect, (x - (self.text_rect.get_width()/2), y - self.text_rect.get_height()/2))
 
+# shared fonts keyed by (path, size) and an lru of rendered text surfaces keyed by (text, size, color)
+# cleared when the ui is rescaled, since every knob and button size changes with UNIT
+class TextCache:
+	def __init__(self, max_size=TEXT_CACHE_SIZE):
+		self.max_size = max_size
+		self.fonts = {}
+		self.surfaces = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def font(self, size, font_path=None):
+		key = (font_path or FONT_PATH, size)
+		font = self.fonts.get(key)
+		if font is None:
+			font = self.fonts[key] = pygame.font.Font(*key)
+		return font
+
+	def render(self, text, size, color, font_path=None):
+		key = (text, size, color, font_path)
+		surface = self.surfaces.get(key)
+		if surface is not None:
+			self.hits += 1
+			self.surfaces.move_to_end(key)
+			return surface
+		self.misses += 1
+		surface = self.surfaces[key] = self.font(size, font_path).render(text, True, color)
+		if len(self.surfaces) > self.max_size:
+			self.surfaces.popitem(last=False)
+		return surface
+
+	def hit_rate(self):
+		return self.hits / max(self.hits + self.misses, 1)
+
+	def clear(self):
+		self.fonts.clear()
+		self.surfaces.clear()
+
+# keeps the last DECAY display spectra in a (DECAY, width) ring, reallocated only when the width changes
+# newer layers are drawn full height over older ones that shrink towards the bottom
+class SpectrumRenderer:
+	def __init__(self, width, height, decay=DECAY, alpha=DECAY_ALPHA):
+		self.width = width
+		self.height = height
+		self.decay = decay
+		self.history = np.zeros((decay, width))
+		self.head = decay - 1 # row of the newest spectrum
+		self.count = 0 # rows filled so far
+		self.layer_scale = 1 - np.arange(decay) / decay # newest first
+		self.points = np.empty((decay, width, 2))
+		self.points[:, :, 0] = np.arange(width)
+		self.tops = np.empty((decay, width), dtype=np.intp)
+		self.rows = np.arange(height)
+		self.mask = np.empty((width, height), dtype=bool)
+		# alpha is premixed with the background so layers cost a plain fill
+		self.colors = []
+		for k in range(decay):
+			a = alpha ** k
+			self.colors.append(tuple(round(b + (c - b) * a) for c, b in zip(SPECTRUM_COLOR, BACKGROUND_COLOR)))
+
+	def matches(self, width, height):
+		return self.width == width and self.height == height
+
+	def advance(self):
+		# returns the row for the next spectrum, overwriting the oldest
+		self.head = (self.head + 1) % self.decay
+		self.count = min(self.count + 1, self.decay)
+		return self.history[self.head]
+
+	def latest(self):
+		return self.history[self.head]
+
+	def draw(self, screen, spectrum_h_range, solid=False):
+		n = self.count
+		if n == 0:
+			return
+		order = (self.head - np.arange(n)) % self.decay
+		ys = self.points[:n, :, 1]
+		np.multiply(self.history[order], self.layer_scale[:n, None], out=ys)
+		np.subtract(spectrum_h_range, ys, out=ys)
+		if not solid:
+			for k in range(n - 1, -1, -1): # oldest first
+				pygame.draw.aalines(screen, self.colors[k], False, self.points[k], 1)
+			return
+
+		# solid view, every column is filled from its top down through a mask on the pixel array
+		tops = self.tops[:n]
+		np.ceil(ys, out=ys)
+		tops[:] = ys
+		lo, hi = max(int(tops.min()), 0), min(int(spectrum_h_range), self.height)
+		if lo >= hi:
+			return
+		pixels = pygame.surfarray.pixels2d(screen)
+		region = pixels[:self.width, lo:hi]
+		mask = self.mask[:, :hi - lo]
+		rows = self.rows[lo:hi]
+		for k in range(n - 1, -1, -1):
+			np.greater_equal(rows, tops[k][:, None], out=mask)
+			np.copyto(region, screen.map_rgb(self.colors[k]), where=mask, casting="unsafe")
+		del region, pixels # unlocks the screen
+
+# scrolling spectrogram with the newest spectrum at the top, on the same log frequency columns as the spectrum view
+# each new spectrum is colour mapped into one row and the persistent history surface scrolls down by one row,
+# so a frame costs the same however much history there is. with a depth below the height every row is
+# drawn a whole number of pixels tall when it is pushed, so nothing is rescaled when drawing
+class Waterfall:
+	def __init__(self, width, height, depth=WATERFALL_DEPTH):
+		self.width = width
+		self.height = height
+		self.row_height = max(1, height // depth) if depth else 1
+		self.depth = -(-height // self.row_height) # rows that fit, the last one may be cut off
+		self.surface = pygame.Surface((width, height)).convert()
+		self.surface.fill(BACKGROUND_COLOR)
+		# quiet levels fade from the background into the spectrum colour, the loudest into the accent
+		levels = np.linspace(0, 1, WATERFALL_COLORS)
+		stops = (0, 0.6, 1)
+		channels = [np.interp(levels, stops, channel) for channel in zip(BACKGROUND_COLOR, SPECTRUM_COLOR, FONT_COLOR_ACCENT)]
+		self.lut = np.array([self.surface.map_rgb(color) for color in zip(*channels)], dtype=np.uint32)
+		self.levels = np.empty(width)
+		self.index = np.empty(width, dtype=np.intp)
+		self.row = np.empty(width, dtype=np.uint32)
+
+	def matches(self, width, height):
+		return self.width == width and self.height == height
+
+	def push(self, spectrum, top):
+		# spectrum in pixels of the spectrum view, top is the height that maps to the last colour
+		np.multiply(spectrum, (len(self.lut) - 1) / top, out=self.levels)
+		np.clip(self.levels, 0, len(self.lut) - 1, out=self.levels)
+		self.index[:] = self.levels
+		np.take(self.lut, self.index, out=self.row)
+		self.surface.scroll(0, self.row_height)
+		pixels = pygame.surfarray.pixels2d(self.surface)
+		pixels[:, :self.row_height] = self.row[:, None]
+		del pixels # unlocks the surface
+
+	def draw(self, screen):
+		screen.blit(self.surface, (0, 0))
+
 # ---------------------------- FUNCTIONS ---------------------------- #
 def get_font_path():
 	if getattr(sys, 'frozen', False):
 		font_path = path.join(sys._MEIPASS, "assets/Product Sans Regular.ttf")
 	else:
-		font_path = "assets/Product Sans Regular.ttf"
+		font_path = path.join(path.dirname(path.abspath(__file__)), "assets/Product Sans Regular.ttf") # works from any working directory
 	return font_path
 
 def get_icon_path():
 	if getattr(sys, 'frozen', False):
 		icon_path = path.join(sys._MEIPASS, "assets/icon.png")
 	else:
-		icon_path = "assets/icon.png"
+		icon_path = path.join(path.dirname(path.abspath(__file__)), "assets/icon.png") # works from any working directory
 	return icon_path
 
-def get_note_map():
-	note_map = {}
-	if getattr(sys, 'frozen', False):
-		file_path = path.join(sys._MEIPASS, "assets/note.map")
-	else:
-		file_path = "assets/note.map"
-	with open(file_path, "r") as f:
-		for line in f:
-			line = line.split()
-			note_map[int(line[0])] = line[1]
-	return note_map
-
-def save_confirmation(screen, filename): 
-	global frame_index
-	frame_max = 100
+def save_confirmation(surface, info, filename, frame_index, dropped=0, error=None):
+	# frame_index counts frames since the file was saved, the message fades out over SAVE_MESSAGE_FRAMES of them
+	# dropped blocks and a writer error that ended the recording early are called out in the message
+	frame_max = SAVE_MESSAGE_FRAMES
 	if frame_index < frame_max:
 		if frame_index < (frame_max*2/3):
 			alpha = 150
 		else:
 			alpha = 150-(((frame_index-(frame_max*2/3))**2)/(frame_max/10))
-		draw_text(f"Saved file to {filename}", font_tiny, info.current_w/2, info.current_h - UNIT - SCALE*16, align="center", color=FONT_COLOR, alpha=alpha)
-		frame_index += 1
-
-def create_log_scale():
-	log_min_freq, log_max_freq = log(MIN_FREQ), log(MAX_FREQ)
-	log_freqs = [log_min_freq + i * (log_max_freq - log_min_freq) / info.current_w for i in range(info.current_w)]
-	freqs = [exp(f) for f in log_freqs]
-	return freqs
-
-def draw_spectrum(screen, previous_spectrums, info, spectrum_h_range, freqs, freqs_tuple):
-	y = 0
-	for s in previous_spectrums[::-1]:
-		points = [(x * info.current_w / len(freqs), y * (value / DECAY) + spectrum_h_range - value) for (x, f), value in zip(freqs_tuple, s)]
-		if view_button.value:
-			pygame.draw.aalines(screen, SPECTRUM_COLOR, False, points, 1)
-		else:
-			points[0] = (0, spectrum_h_range)
-			points[-1] = (info.current_w, spectrum_h_range)
-			pygame.draw.polygon(screen, SPECTRUM_COLOR, points)
-		y += 1
+		message = f"Saved file to {filename}" if error is None else f"Recording to {filename} stopped early: {error}"
+		message += f", {dropped} blocks dropped because the writer fell behind" if dropped else ""
+		draw_text(surface, message, FONT_TINY, info.current_w/2, info.current_h - UNIT - SCALE*16, align="center", color=MIC_BUTTON_COLOR if dropped or error else FONT_COLOR, alpha=alpha)
+
+def create_log_scale(width, max_freq=RATE / 2):
+	log_min_freq, log_max_freq = log(MIN_FREQ), log(max_freq)
+	return np.exp(np.linspace(log_min_freq, log_max_freq, width, endpoint=False))
+
+def draw_title(surface):
+	draw_text(surface, TITLE, FONT_LARGE, SCALE * 10, SCALE * 20, color=TIERTIARY_COLOR, align="left")
+	draw_text(surface, "by Alec Ames", FONT_TINY, SCALE * 32, SCALE * 37, color=TIERTIARY_COLOR, align="left")
 
-def draw_text(text, font, x, y, align="center", color=FONT_COLOR, alpha=255):
-	rendered_text = font.render(text, True, color)
+def draw_text(surface, text, size, x, y, align="center", color=FONT_COLOR, alpha=255):
+	rendered_text = text_cache.render(text, size, color)
 	text_rect = rendered_text.get_rect()
 	if align == "center":
 		text_rect.center = (x, y)
@@ -244,257 +436,1895 @@ def draw_text(text, font, x, y, align="center", color=FONT_COLOR, alpha=255):
 		text_rect.center = (int(x + rendered_text.get_width()/2), y)
 	elif align == "right":
 		text_rect.center = (int(x - rendered_text.get_width()/2), y)
-	rendered_text.set_alpha(alpha)
-	screen.blit(rendered_text, text_rect)
-
-def note_equivalent(note_map, tmp_freq):
-	freq = tmp_freq
-	note = int(round(12 * np.log2(freq / 440) + 69))
-	if note in note_map:
-		notename = note_map[note]
+	if alpha != 255: # cached surfaces are shared, so the alpha is restored after the blit
+		rendered_text.set_alpha(alpha)
+		surface.blit(rendered_text, text_rect)
+		rendered_text.set_alpha(255)
+	else:
+		surface.blit(rendered_text, text_rect)
+
+def note_equivalent(freq):
+	note = int(round(12 * log2(freq / 440) + 69)) if freq > 0 else -1
+	if 0 <= note < len(NOTE_NAMES):
+		notename = str(NOTE_NAMES[note])
 	else:
 		notename = ""
 	return freq,notename
 
-def save_file(output_file):
-	timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-	out_file_name = f'out/recorded_audio_{timestamp}.wav'
-	if not path.exists('out'):
-		makedirs('out')
-	write(out_file_name, 44100, output_file)
-	output_file = None
-	return out_file_name
-
-def draw_keybinds(screen):
-	draw_text("KEYBINDS", font_medium, info.current_w/2, info.current_h/2 - (SCALE * info.current_h/3.5))
-	draw_text("Click the title again to close this menu", font_tiny, info.current_w/2, info.current_h/2 - (SCALE * info.current_h/3.5) + (SCALE * 30))
-	draw_text("Hold CTRL to fine-tune knobs", font_xtiny, info.current_w - SCALE * 5, info.current_h - UNIT - SCALE * 34, color=CTRL_CLICKED, align="right")
-	draw_text("Hold SHIFT to reset knob to defaults", font_xtiny, info.current_w - SCALE * 5, info.current_h - UNIT - SCALE * 22, color=CTRL_CLICKED, align="right")
-	draw_text("Right click on FREEZE button to toggle freeze mode", font_xtiny, info.current_w - SCALE * 5, info.current_h - UNIT - SCALE * 10 , color=CTRL_CLICKED, align="right")
-	pygame.draw.line(screen, FONT_COLOR, (info.current_w/2 - (SCALE * 100), info.current_h/2 - (SCALE * info.current_h/3.5) + (SCALE * 45)), (info.current_w/2 + (SCALE * 100), info.current_h/2 - (SCALE * info.current_h/3.5) + (SCALE * 45)), 1)
+def note_names(freqs):
+	# vectorized note_equivalent, names for an array of frequencies
+	freqs = np.asarray(freqs, dtype=np.float64)
+	notes = np.full(freqs.shape, -1, dtype=np.intp)
+	audible = freqs > 0
+	notes[audible] = np.rint(12 * np.log2(freqs[audible] / 440) + 69)
+	valid = (notes >= 0) & (notes < len(NOTE_NAMES))
+	names = np.full(freqs.shape, "", dtype=NOTE_NAMES.dtype)
+	names[valid] = NOTE_NAMES[notes[valid]]
+	return names
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(prog="spectrumtool", description="Real-time spectrum analyzer with audio effects.")
+	batch = parser.add_argument_group("batch mode", "process a .wav file offline, without display or audio device")
+	batch.add_argument("--batch", metavar="WAV", help="input .wav file to process")
+	batch.add_argument("--out", default="out", help="output folder (default: out)")
+	batch.add_argument("--spectrogram", choices=("npy", "csv"), default="npy", help="full spectrogram as .npy, or peak frequency and note per frame as .csv")
+	batch.add_argument("--workers", type=int, default=1, help="processes used to split long files (default: 1)")
+	batch.add_argument("--dist", type=float, default=1, help="DIST knob value, 1 to 512 (default: 1)")
+	batch.add_argument("--shift", type=float, default=0, help=f"SHIFT knob value, {-SHIFT_MAX//2} to {SHIFT_MAX//2} (default: 0)")
+	batch.add_argument("--gain", type=float, default=0.8, help="GAIN knob value, 0 to 1.2 (default: 0.8)")
+	analysis = parser.add_argument_group("analysis")
+	analysis.add_argument("--pitch", choices=("peak", "hps", "autocorr"), default=PITCH_MODE, help=f"how the peak readout finds the fundamental: loudest peak, harmonic product spectrum or autocorrelation (default: {PITCH_MODE})")
+	publish = parser.add_argument_group("publishing", "share every analysed frame with other local processes, read them with spectrumclient.py")
+	publish.add_argument("--publish", metavar="NAME", nargs="?", const=SHM_NAME, help=f"write frames to a shared memory ring (default name: {SHM_NAME})")
+	publish.add_argument("--publish-udp", metavar="PORT", type=int, help="also send every frame to this localhost udp port")
+	publish.add_argument("--publish-unix", metavar="PATH", help="also send every frame to the unix datagram socket at this path")
+	audio = parser.add_argument_group("audio", f"these can also be set in the [audio] section of an ini file, using the option names without dashes (read from {CONFIG_FILE} beside spectrumtool.py when present)")
+	audio.add_argument("--config", metavar="INI", help="read audio settings from this file instead, command line options still override it")
+	audio.add_argument("--device", metavar="INDEX", type=int, default=DEVICE, help="input device index (default: system default)")
+	audio.add_argument("--output-device", metavar="INDEX", type=int, default=OUTPUT_DEVICE, help="output device index (default: system default)")
+	audio.add_argument("--rate", type=int, default=RATE, help=f"sample rate in hz (default: {RATE})")
+	audio.add_argument("--buffer", type=int, default=BUFFER, help=f"frames per audio block, a power of two (default: {BUFFER})")
+	audio.add_argument("--format", choices=tuple(SAMPLE_FORMATS), default=SAMPLE_FORMAT, help=f"stream sample format (default: {SAMPLE_FORMAT})")
+	audio.add_argument("--channels", type=int, default=CHANNELS, help=f"captured and played channels (default: {CHANNELS})")
+	audio.add_argument("--list-devices", action="store_true", help="print the audio devices and their indices, then exit")
+	monitor = parser.add_argument_group("monitoring", "several input devices at once, each captured and analysed in its own process and shown in its own pane (no audio output)")
+	monitor.add_argument("--devices", metavar="INDEX", type=int, nargs="+", help="input device indices to monitor, the audio options above apply to each")
+	monitor.add_argument("--layout", choices=("tiled", "stacked"), default=MONITOR_LAYOUT, help=f"arrange panes in a grid or one column (default: {MONITOR_LAYOUT})")
+	profile = parser.add_argument_group("profiling")
+	profile.add_argument("--profile-export", metavar="FILE", help="append stage timings to a .csv file, or a .json file (one snapshot per line)")
+	profile.add_argument("--profile-interval", metavar="SECONDS", type=float, default=10, help="seconds between profile exports (default: 10)")
+	profile.add_argument("--startup-profile", action="store_true", help="print how long imports and each startup stage took, once the first frame is shown and audio has started")
+	# the config file only changes defaults, so anything given on the command line still wins
+	known, _ = parser.parse_known_args(argv)
+	config_file = known.config or path.join(path.dirname(path.abspath(__file__)), CONFIG_FILE)
+	if known.config or path.exists(config_file):
+		parser.set_defaults(**read_config(parser, config_file, audio))
+	args = parser.parse_args(argv)
+	if args.rate <= 0:
+		parser.error(f"--rate must be positive, got {args.rate}")
+	if args.buffer < 2 or args.buffer & (args.buffer - 1):
+		parser.error(f"--buffer must be a power of two, got {args.buffer}")
+	if args.channels < 1:
+		parser.error(f"--channels must be at least 1, got {args.channels}")
+	# batch knobs get the ranges of the ui knobs, checked before run_batch creates any output
+	if args.workers < 1:
+		parser.error(f"--workers must be at least 1, got {args.workers}")
+	if not 1 <= args.dist <= 512:
+		parser.error(f"--dist must be between 1 and 512, got {args.dist:g}")
+	if not -SHIFT_MAX/2 <= args.shift <= SHIFT_MAX/2:
+		parser.error(f"--shift must be between {-SHIFT_MAX//2} and {SHIFT_MAX//2}, got {args.shift:g}")
+	if not 0 <= args.gain <= 1.2:
+		parser.error(f"--gain must be between 0 and 1.2, got {args.gain:g}")
+	if args.batch and not path.isfile(args.batch):
+		parser.error(f"input file '{args.batch}' not found")
+	return args
+
+def read_config(parser, filename, group):
+	# [audio] section as defaults for the options of group, values are parsed like the command line would
+	config = configparser.ConfigParser()
+	try:
+		if not config.read(filename):
+			parser.error(f"config file '{filename}' not found")
+	except configparser.Error as error:
+		parser.error(f"config file '{filename}': {error}")
+	if not config.has_section("audio"):
+		return {}
+	actions = {action.dest: action for action in group._group_actions if action.type is not None or action.choices is not None}
+	defaults = {}
+	for key, value in config.items("audio"):
+		action = actions.get(key.replace("-", "_"))
+		if action is None:
+			parser.error(f"config file '{filename}': unknown audio setting '{key}', expected one of {', '.join(actions)}")
+		if value.strip() == "" or value.strip().lower() == "default":
+			defaults[action.dest] = action.default
+			continue
+		try:
+			defaults[action.dest] = action.type(value) if action.type is not None else value.strip()
+		except ValueError:
+			parser.error(f"config file '{filename}': invalid {key} '{value}'")
+		if action.choices is not None and defaults[action.dest] not in action.choices:
+			parser.error(f"config file '{filename}': {key} must be one of {', '.join(action.choices)}, got '{value}'")
+	return defaults
+
+def list_devices():
+	pyaudio = PyAudio()
+	try:
+		for i in range(pyaudio.get_device_count()):
+			device = pyaudio.get_device_info_by_index(i)
+			print(f"{i:>3}  {device['name']}  (in {device['maxInputChannels']}, out {device['maxOutputChannels']}, {device['defaultSampleRate']:.0f} Hz)")
+	finally:
+		pyaudio.terminate()
+
+def draw_keybinds(surface, info):
+	draw_text(surface, "KEYBINDS", FONT_MEDIUM, info.current_w/2, info.current_h/2 - (SCALE * info.current_h/3.5))
+	draw_text(surface, "Click the title again to close this menu", FONT_TINY, info.current_w/2, info.current_h/2 - (SCALE * info.current_h/3.5) + (SCALE * 30))
+	draw_text(surface, "Hold CTRL to fine-tune knobs", FONT_XTINY, info.current_w - SCALE * 5, info.current_h - UNIT - SCALE * 34, color=CTRL_CLICKED, align="right")
+	draw_text(surface, "Hold SHIFT to reset knob to defaults", FONT_XTINY, info.current_w - SCALE * 5, info.current_h - UNIT - SCALE * 22, color=CTRL_CLICKED, align="right")
+	draw_text(surface, "Right click on FREEZE button to toggle freeze mode", FONT_XTINY, info.current_w - SCALE * 5, info.current_h - UNIT - SCALE * 10 , color=CTRL_CLICKED, align="right")
+	pygame.draw.line(surface, FONT_COLOR, (info.current_w/2 - (SCALE * 100), info.current_h/2 - (SCALE * info.current_h/3.5) + (SCALE * 45)), (info.current_w/2 + (SCALE * 100), info.current_h/2 - (SCALE * info.current_h/3.5) + (SCALE * 45)), 1)
 	keybinds = [
 		("View", "V", "Toggle view"),
+		("Waterfall", "W", "Toggle waterfall view"),
 		("Mute", "M", "Toggle mute"),
 		("Mic", "N", "Toggle mic"),
 		("Freeze", "F", "Freeze spectrum"),
 		("Record", "R", "Record audio to .wav file"), 
+		("Profiler", "P", "Toggle profiler overlay"),
 		("Quit", "ESC", "Close the application")]
 	for i, keybind in enumerate(keybinds):
-		keybind_text = font_tiny.render(f"{keybind[0]} [{keybind[1]}] - {keybind[2]}", True, FONT_COLOR)
+		keybind_text = text_cache.render(f"{keybind[0]} [{keybind[1]}] - {keybind[2]}", FONT_TINY, FONT_COLOR)
 		keybind_rect = keybind_text.get_rect()
 		keybind_rect.center = (info.current_w/2, info.current_h/2 - (SCALE * info.current_h/3.5) + (SCALE * 60) + (SCALE * 20 * i))
-		screen.blit(keybind_text, keybind_rect)
+		surface.blit(keybind_text, keybind_rect)
 
 # ---------------------------- AUDIO FX ---------------------------- #
-@jit(nopython=True)
-def gain(in_data, gain):
-	out_data = in_data * gain
-	return out_data
-
-def dist_fx(in_data, amount):
-	out_data = in_data
-	if amount == 1: return out_data
-	out_data = np.clip(out_data, MIN_INT/amount, MAX_INT/amount)
-	out_data = out_data * (amount + 10)/12
-	out_data = np.clip(out_data, MIN_INT, MAX_INT)
-	return out_data
-
-def freq_shift_delay_fx(in_data, shift):
-	out_data = in_data
-	fft_data = np.fft.rfft(out_data)
-	fft_data = np.roll(fft_data, int(shift - shift_max/2))
-	out_data = np.fft.irfft(fft_data)
-	return out_data
+# numba is only imported when a kernel is first needed, the compiled kernel is cached on disk by numba
+# warm_kernels compiles (or loads) them on a background thread so the first audio block doesn't stall
+class LazyKernel:
+	def __init__(self, fn):
+		self.fn = fn
+		self.kernel = None
+		self.lock = threading.Lock()
 
-# ---------------------------- MAIN ---------------------------- #
-pygame.init() 
-screen = pygame.display.set_mode((800, 500), pygame.RESIZABLE)
-FONT_PATH = get_font_path() # font by Google https://befonts.com/product-sans-font.html
-pygame.display.set_caption(TITLE)
-icon = pygame.image.load(get_icon_path()) # application icon by Icons8 https://icons8.com
-pygame.display.set_icon(icon)
-audio_data = np.zeros(BUFFER)
-
-# init audio streams for in and out
-p = PyAudio()
-mic_stream = p.open(format=paInt16, channels=1, rate=RATE, input=True, frames_per_buffer=BUFFER)
-out_stream = p.open(format=paInt16, channels=1, rate=RATE, output=True, frames_per_buffer=BUFFER)
-
-# init variables
-previous_spectrums = []
-shift_max = 48
-peak_freq = 0
-peak_notename = ""
-show_keybinds = False
-output_file = None
-frame_index = 0
-out_file_name = None
-
-# init fonts
-font_xtiny = pygame.font.Font(FONT_PATH, round(SCALE* 10))
-font_tiny = pygame.font.Font(FONT_PATH, round(SCALE* 12))
-font_small = pygame.font.Font(FONT_PATH, round(SCALE* 16))
-font_medium = pygame.font.Font(FONT_PATH, round(SCALE* 20))
-font_large = pygame.font.Font(FONT_PATH, round(SCALE* 28))
-
-# init buttons and knobs
-view_button = Button("LINE", True, pygame.K_v, alt_text="SOLID", idle_color=CTRL_CLICKED, clicked_color=CTRL_CLICKED)
-mic_button = Button("MIC", True, pygame.K_n, idle_color=TIERTIARY_COLOR, clicked_color=MIC_BUTTON_COLOR)
-mute_button = Button("MUTE", False, pygame.K_m, idle_color=TIERTIARY_COLOR, clicked_color=CTRL_CLICKED)
-gain_knob = Knob(0, 1.2, "GAIN", 0.8)
-dist_knob = Knob(1, 512, "DIST", 1)
-freq_shift_knob = Knob(0, shift_max, "SHIFT", shift_max/2, percent=False)
-record_button = Button("REC", False, pygame.K_r, idle_color=CTRL_IDLE, clicked_color=MIC_BUTTON_COLOR)
-freeze_button = Button("FREEZE", False, pygame.K_f, toggle=False, clicked_color=FREEZE_BUTTON_COLOR)
-note_map = get_note_map()
-
-while True:
-	if not freeze_button.value: # freeze the spectrum (and audio)
-		data = mic_stream.read(BUFFER)
-		if not mic_button.value: # mute mic
-			data = b'\x00' * BUFFER
-	audio_data = np.frombuffer(data, dtype=np.int16)
-
-	# effects chain
-	audio_data = dist_fx(audio_data, dist_knob.value)
-	audio_data = freq_shift_delay_fx(audio_data, freq_shift_knob.value)
-	audio_data = gain(audio_data, gain_knob.value)
-
-	# fft for spectrum visualization
-	spectrum = np.abs(np.fft.rfft(audio_data, n=RESOLUTION))
-
-	# visual representation of spectrum
-	info = pygame.display.Info()
-	spectrum_h_range = info.current_h - UNIT # compensate for the control bar
-	dp_spectrum = spectrum
-	freqs = create_log_scale()
-	freqs_tuple = [(x, f) for x, f in enumerate(freqs)]
-	dp_spectrum = np.interp(freqs, np.linspace(0, MAX_FREQ, len(dp_spectrum)), dp_spectrum)
-	dp_spectrum /= (2 ** 18) # scales down spectrum to fit on screen
-	if np.max(dp_spectrum) > 1: 
-		dp_spectrum /= np.max(dp_spectrum)
-	dp_spectrum *= spectrum_h_range * 0.95 # prevents from touching the top of the screen
-
-	previous_spectrums.append(dp_spectrum) # adds spectrum to list of previous spectrums (for decay)
-	if len(previous_spectrums) > DECAY: # pops off the oldest spectrum if the list is too long
-		previous_spectrums.pop(0)
-
-	# draws spectrum
-	screen.fill(BACKGROUND_COLOR)
-	draw_text(TITLE, font_large, SCALE * 10, SCALE * 20, color=TIERTIARY_COLOR, align="left")
-	draw_text("by Alec Ames", font_tiny, SCALE * 32, SCALE * 37, color=TIERTIARY_COLOR, align="left")
-	draw_spectrum(screen, previous_spectrums, info, spectrum_h_range, freqs, freqs_tuple)
-
-	# audio data to output stream
-	if record_button.value: 
-		if output_file is None:
-			output_file = np.int16(audio_data)/(RATE/4)
+	def compile(self):
+		with self.lock:
+			if self.kernel is None:
+				from numba import jit
+				self.kernel = jit(nopython=True, cache=True)(self.fn)
+		return self.kernel
+
+	def __call__(self, *args):
+		return (self.kernel or self.compile())(*args)
+
+# distortion and gain fused into one pass, in place (gain commutes with the linear shifter that used to sit between them)
+# samples are floats with full scale at 1, the clip is the same at any bit depth
+@LazyKernel
+def dist_gain_fx(buffer, amount, gain):
+	lo, hi = -1 / amount, 1 / amount
+	makeup = (amount + 10) / 12
+	for i in range(buffer.shape[0]):
+		value = buffer[i]
+		if amount != 1:
+			value = min(max(value, lo), hi) * makeup
+			value = min(max(value, -1.0), 1.0)
+		buffer[i] = value * gain
+
+# clips to full scale, scales and interleaves the (channels, frames) buffer into out in one pass
+# out has the stream's sample type, so each stream format is its own specialization
+@LazyKernel
+def to_output(buffer, out, scale, lo, hi):
+	channels = buffer.shape[0]
+	for c in range(channels):
+		for i in range(buffer.shape[1]):
+			out[i * channels + c] = min(max(buffer[c, i] * scale, lo), hi)
+
+# deinterleaves stream samples into the (channels, frames) buffer and scales them to full scale at 1, in one pass
+@LazyKernel
+def from_input(samples, out, scale):
+	channels = out.shape[0]
+	for c in range(channels):
+		for i in range(out.shape[1]):
+			out[c, i] = samples[i * channels + c] * scale
+
+def output_array(sample_format, size):
+	# the array to_output fills for this format and its (scale, lo, hi), int24 goes through int32 and is packed after
+	width, full_scale = SAMPLE_FORMATS[sample_format]
+	if not full_scale:
+		return np.zeros(size, dtype=np.float32), (1.0, -1.0, 1.0)
+	return np.zeros(size, dtype=np.dtype(f"i{4 if width == 3 else width}")), (float(full_scale), float(-full_scale), float(full_scale - 1))
+
+def warm_kernels(sample_format=SAMPLE_FORMAT):
+	# called with the argument types the audio callback uses, so that exact specialization is ready
+	start = perf_counter_ns()
+	buffer = np.zeros((1, BUFFER), dtype=np.float32)
+	dist_gain_fx(buffer.reshape(-1), 1.0, 1.0)
+	out, params = output_array(sample_format, BUFFER)
+	to_output(buffer, out, *params)
+	width = SAMPLE_FORMATS[sample_format][0]
+	decode_samples(bytes(BUFFER * width), sample_format, buffer, np.zeros((BUFFER, 4), dtype=np.uint8) if width == 3 else None)
+	startup_stage("kernels (background)", start)
+
+def decode_samples(data, sample_format, out, widened=None):
+	# interleaved stream bytes to (channels, frames) float32 in out, full scale at 1
+	# widened is a zeroed (samples, 4) uint8 scratch array for int24, allocated here when not given
+	width, full_scale = SAMPLE_FORMATS[sample_format]
+	if sample_format == "int24": # packed 3 byte samples, moved into the top of an int32 so the sign comes along
+		packed = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+		if widened is None:
+			widened = np.zeros((len(packed), 4), dtype=np.uint8)
+		widened[:, 1:] = packed
+		samples, full_scale = widened.view(np.int32).reshape(-1), SAMPLE_FORMATS["int32"][1]
+	else:
+		samples = np.frombuffer(data, dtype=np.dtype(f"{'i' if full_scale else 'f'}{width}"))
+	from_input(samples, out, 1 / full_scale if full_scale else 1.0)
+	return out
+
+def encode_samples(block, sample_format):
+	# (channels, frames) floats to interleaved bytes, clipped to full scale
+	# allocates, for the recorder which queues a copy anyway, the chain converts with to_output
+	width, full_scale = SAMPLE_FORMATS[sample_format]
+	samples = np.reshape(block, (-1, np.shape(block)[-1])).T
+	if not full_scale:
+		return np.clip(samples, -1, 1).astype("<f4").tobytes()
+	samples = np.clip(np.multiply(samples, full_scale, dtype=np.float64), -full_scale, full_scale - 1).astype("<i4" if width == 3 else f"<i{width}", order="C")
+	if width == 3: # low three bytes of each little endian int32
+		return samples.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+	return samples.tobytes()
+
+def shift_to_hz(shift, rate=RATE, buffer=BUFFER):
+	# the SHIFT knob counts bins of a buffer point fft around its center, anything shown as 0 is no shift
+	offset = shift - SHIFT_MAX/2
+	if abs(offset) < 1:
+		return 0
+	return offset * rate / buffer
+
+def shift_is_periodic(shift):
+	# whole bins are whole cycles per block, so a repeated input block gives a repeated output block
+	offset = shift - SHIFT_MAX/2
+	return abs(offset) < 1 or offset == int(offset)
+
+# single sideband frequency shifter, carries its state across blocks
+# the analytic signal comes from a hann windowed stft that is overlap-added back after the shift,
+# so the shift is continuous instead of whole bins and block edges don't click
+# every channel goes through the same batched transforms, buffers are (channels, frames) or 1-D for a single channel
+# centered it is bypassed, so there is no fft_size - hop latency, and crossing the center crossfades over one block
+# between the delayed shifted output and the dry input
+class FrequencyShifter:
+	replayable = True # a repeated block repeats once the shift is whole cycles per block, which the engine checks
+
+	def __init__(self, rate=RATE, hz=0, fft_size=SHIFT_FFT_SIZE, buffer=BUFFER, overlap=OVERLAP, channels=1):
+		hop = min(int(fft_size * (1 - overlap)), fft_size // 2, buffer)
+		self.rate = rate
+		self.channels = channels
+		self.fft_size = fft_size
+		self.hop = 1 << (hop.bit_length() - 1) # power of two so it divides both the fft size and the buffer
+		self.window_name = "hann"
+		self.window = make_window("hann", fft_size)
+		self.ola_gain = self.window.reshape(-1, self.hop).sum(axis=0).mean()
+		self.analytic = np.full(fft_size // 2 + 1, 2.0) # doubles positive frequencies, negative ones are left at zero
+		self.analytic[0] = self.analytic[-1] = 1
+		self.hz = None
+		self.set_shift(hz)
+		self.reset()
+
+	def reset(self, position=0):
+		# position is the absolute index of the next input sample, so separate runs stay phase aligned
+		self.history = np.zeros((self.channels, self.fft_size - self.hop))
+		self.tail = np.zeros((self.channels, self.fft_size - self.hop))
+		self.phase = self.omega * position % (2 * np.pi)
+		self.spectrum = None # rfft of the newest frame of each channel, shared with the display analysis
+		self.frames = 0
+		self.signal = np.zeros((self.channels, 0))
+		self.out = np.zeros((self.channels, 0))
+		self.bypassed = self.hz == 0 # whether the last block was passed through
+
+	@property
+	def latency(self):
+		# samples the output lags the input by at the current shift
+		return 0 if self.hz == 0 else self.fft_size - self.hop
+
+	def set_shift(self, hz):
+		if hz != self.hz:
+			self.hz = hz
+			self.omega = 2 * np.pi * hz / self.rate
+			self.phasor = np.exp(1j * self.omega * np.arange(self.fft_size))
+
+	def process(self, buffer):
+		# in place, the length must be a multiple of hop
+		channels = buffer.reshape(self.channels, -1) # a view, so writing it writes buffer
+		n = channels.shape[1]
+		history, tail = self.history, self.tail
+		if self.hz == 0 and self.bypassed: # knob centered, only keep the history current
+			if n >= history.shape[1]:
+				history[:] = channels[:, n - history.shape[1]:]
+			else: # moved a block at a time, so no copy overlaps its source and needs a temporary
+				keep = history.shape[1] - n
+				for start in range(0, keep, n):
+					end = min(start + n, keep)
+					history[:, start:end] = history[:, start + n:end + n]
+				history[:, -n:] = channels
+			self.spectrum = None
+			return buffer
+		if self.signal.shape[1] != history.shape[1] + n: # work buffers follow the block size
+			self.signal = np.zeros((self.channels, history.shape[1] + n))
+			self.out = np.zeros((self.channels, tail.shape[1] + n))
+			self.weights = np.zeros(history.shape[1] + n) # summed windows of the block's frames over signal
+			for start in range(0, n, self.hop):
+				self.weights[start:start + self.fft_size] += self.window
+			self.dry = np.zeros((self.channels, n), dtype=buffer.dtype)
+			self.fade = (0.5 - 0.5 * np.cos(np.pi * (np.arange(n) + 0.5) / n)).astype(buffer.dtype) # rises over the block
+			self.unfade = 1 - self.fade
+		signal, out = self.signal, self.out
+		signal[:, :history.shape[1]] = history
+		signal[:, history.shape[1]:] = channels
+		history[:] = signal[:, n:]
+		crossing = self.bypassed != (self.hz == 0)
+		if crossing:
+			self.dry[:] = channels
+		if self.hz == 0: # crossing into the bypass, an unshifted frame is just the windowed input, so the delayed output
+			# runs on for this block without the transforms while the dry input fades in over it
+			out[:, :tail.shape[1]] = tail
+			out[:, tail.shape[1]:] = 0
+			out += np.multiply(signal, self.weights, out=signal)
+			np.divide(out[:, :n], self.ola_gain, out=channels)
+			channels *= self.unfade
+			channels += np.multiply(self.dry, self.fade, out=self.dry)
+			self.bypassed = True
+			self.spectrum = None
+			return buffer
+		if self.bypassed: # leaving the bypass, the tail an unshifted run would have left on the history
+			np.multiply(signal[:, :history.shape[1]], self.weights[n:], out=tail)
+		frames = np.lib.stride_tricks.sliding_window_view(signal, self.fft_size, axis=1)[:, ::self.hop]
+		spectra = np.fft.rfft(frames * self.window, axis=2)
+		n_frames = spectra.shape[1]
+		self.spectrum = spectra[:, -1]
+		self.frames += n_frames
+
+		# analytic frames, moved up by hz with a phase that runs on from the previous frame
+		analytic = np.fft.ifft(spectra * self.analytic, n=self.fft_size, axis=2)
+		phases = self.phase + self.omega * self.hop * np.arange(n_frames)
+		self.phase = (self.phase + self.omega * self.hop * n_frames) % (2 * np.pi)
+		analytic *= self.phasor
+		analytic *= np.exp(1j * phases)[:, None]
+		shifted = analytic.real.reshape(self.channels, n_frames, -1, self.hop)
+
+		# overlap-add, the part that overlaps the next block is kept in tail
+		out[:, :tail.shape[1]] = tail
+		out[:, tail.shape[1]:] = 0
+		for r in range(shifted.shape[2]):
+			out[:, r * self.hop:r * self.hop + n] += shifted[:, :, r].reshape(self.channels, -1)
+		tail[:] = out[:, n:]
+		np.divide(out[:, :n], self.ola_gain, out=channels)
+		if crossing: # the shifted output fades in over the dry input
+			channels *= self.fade
+			channels += np.multiply(self.dry, self.unfade, out=self.dry)
+			self.bypassed = False
+		return buffer
+
+# the distortion/gain kernel, the shifter and any registered stages run in place on one preallocated float32 buffer
+# stream samples are converted into it and out of it through preallocated arrays too
+# a stage is any object with a process(buffer) method that modifies buffer in place
+# stateless stages also have a params() method, their output only depends on the input and those values
+# stateful stages can set replayable = True when a block fed to them over and over settles into the same output
+# every block, the engine only replays the last block (see AudioEngine) while every stage is one or the other
+class DistortionGain:
+	def __init__(self, amount=1, gain=1):
+		self.amount = amount
+		self.gain = gain
+
+	def params(self):
+		return (self.amount, self.gain)
+
+	def process(self, buffer):
+		dist_gain_fx(buffer.reshape(-1), float(self.amount), float(self.gain)) # knob values can be ints, one signature keeps it to one compile
+
+class EffectsChain:
+	def __init__(self, rate=RATE, buffer=BUFFER, channels=1, sample_format=SAMPLE_FORMAT):
+		self.sample_format = sample_format
+		self.buffer = np.zeros((channels, buffer), dtype=np.float32) # one row per channel
+		self.output, self.output_params = output_array(sample_format, buffer * channels) # interleaved output samples
+		int24 = sample_format == "int24"
+		self.widened = np.zeros((buffer * channels, 4), dtype=np.uint8) if int24 else None # int24 input moved into int32
+		self.packed = np.zeros((buffer * channels, 3), dtype=np.uint8) if int24 else None # int24 output bytes
+		self.prefix = np.zeros((channels, buffer), dtype=np.float32) # output of the leading stateless stages
+		self.prefix_key = None
+		self.dist_gain = DistortionGain()
+		self.shifter = FrequencyShifter(rate, buffer=buffer, channels=channels)
+		self.stages = [self.dist_gain, self.shifter]
+
+	def add(self, stage, index=None):
+		# appended after the built in stages unless an index is given
+		if index is None:
+			self.stages.append(stage)
+		else:
+			self.stages.insert(index, stage)
+
+	def remove(self, stage):
+		self.stages.remove(stage)
+
+	def replayable(self):
+		# whether a repeated input settles into a repeated output, stages that don't say so might be a delay or an lfo
+		return all(hasattr(stage, "params") or getattr(stage, "replayable", False) for stage in self.stages)
+
+	def process(self, in_data, version=None):
+		# interleaved stream bytes in, returns the float32 (channels, frames) buffer, reused on the next call, and the output bytes
+		# version identifies the input block, while it and the params of the leading stateless stages are unchanged
+		# their output is reused and only the stages after them run
+		n_stateless = 0
+		while n_stateless < len(self.stages) and hasattr(self.stages[n_stateless], "params"):
+			n_stateless += 1
+		key = (version, [stage.params() for stage in self.stages[:n_stateless]]) if version is not None else None
+		if key is not None and key == self.prefix_key:
+			np.copyto(self.buffer, self.prefix)
+		else:
+			decode_samples(in_data, self.sample_format, self.buffer, self.widened)
+			for stage in self.stages[:n_stateless]:
+				stage.process(self.buffer)
+			np.copyto(self.prefix, self.buffer)
+			self.prefix_key = key
+		for stage in self.stages[n_stateless:]:
+			stage.process(self.buffer)
+		to_output(self.buffer, self.output, *self.output_params)
+		if self.packed is not None: # low three bytes of each little endian int32
+			np.copyto(self.packed, self.output.view(np.uint8).reshape(-1, 4)[:, :3])
+			return self.buffer, self.packed.tobytes()
+		return self.buffer, self.output.tobytes() # the bytes handed to pyaudio are the only allocation
+
+# ---------------------------- ANALYSIS ---------------------------- #
+# maps linearly spaced fft bins onto the log-spaced pixel columns of the window
+# everything is computed once, rebuild only when the width or the fft size changes
+class FrequencyAxis:
+	def __init__(self, width, n_bins, mode=AXIS_MODE, max_freq=RATE / 2):
+		self.width = width
+		self.n_bins = n_bins
+		self.mode = mode
+		self.max_freq = max_freq # half the sample rate, the frequency of the last bin
+		self.freqs = create_log_scale(width, max_freq)
+		bin_width = max_freq / (n_bins - 1)
+
+		# point interpolation between the two nearest bins
+		position = np.clip(self.freqs / bin_width, 0, n_bins - 1)
+		self.lo = np.minimum(position.astype(np.intp), n_bins - 2)
+		self.hi = self.lo + 1
+		self.weight = position - self.lo
+
+		# bins under each pixel, pixel edges sit halfway (in log) between neighbouring columns
+		log_freqs = np.log(self.freqs)
+		step = log_freqs[1] - log_freqs[0] if width > 1 else 0
+		edges = np.exp(np.append(log_freqs - step/2, log_freqs[-1] + step/2)) / bin_width
+		starts = np.clip(np.ceil(edges[:-1]), 0, n_bins).astype(np.intp)
+		ends = np.clip(np.ceil(edges[1:]), 0, n_bins).astype(np.intp)
+		wide = (ends - starts) >= 2 # pixels narrower than two bins keep the interpolated value
+		self.wide = np.flatnonzero(wide)
+		self.pairs = np.empty(2 * len(self.wide), dtype=np.intp)
+		self.pairs[0::2] = starts[wide]
+		self.pairs[1::2] = ends[wide]
+		self.counts = (ends - starts)[wide]
+		self.padded = np.zeros(n_bins + 1) # reduceat needs a valid index one past the last bin
+
+	def matches(self, width, n_bins, max_freq=RATE / 2):
+		return self.width == width and self.n_bins == n_bins and self.max_freq == max_freq
+
+	def map(self, spectrum, out=None):
+		if out is None:
+			out = np.empty(self.width)
+		np.multiply(spectrum[self.lo], 1 - self.weight, out=out)
+		out += spectrum[self.hi] * self.weight
+		if self.mode != "interp" and len(self.wide):
+			self.padded[:self.n_bins] = spectrum
+			if self.mode == "max":
+				out[self.wide] = np.maximum.reduceat(self.padded, self.pairs)[0::2]
+			else:
+				out[self.wide] = np.add.reduceat(self.padded, self.pairs)[0::2] / self.counts
+		return out
+
+# cosine-sum window coefficients
+WINDOWS = {
+	"hann": (0.5, 0.5),
+	"blackmanharris": (0.35875, 0.48829, 0.14128, 0.01168),
+	"flattop": (0.21557895, 0.41663158, 0.277263158, 0.083578947, 0.006947368),
+}
+
+def make_window(name, size):
+	if name not in WINDOWS:
+		raise ValueError(f"unknown window '{name}', expected one of {', '.join(WINDOWS)}")
+	phase = 2 * np.pi * np.arange(size) / size # periodic window for spectral analysis
+	window = np.zeros(size)
+	for k, a in enumerate(WINDOWS[name]):
+		window += (-1) ** k * a * np.cos(k * phase)
+	return window
+
+# windowed stft over the newest samples of the engine ring, one frame every hop samples
+# output is magnitude in dBFS, scaled so a full scale sine reads 0 dB whatever the window
+# every channel is analysed in one batched rfft, db is the loudest channel in each bin
+class SpectrumAnalyzer:
+	def __init__(self, fft_size=FFT_SIZE, window=WINDOW, overlap=OVERLAP, rate=RATE, channels=1):
+		if fft_size < 2 or fft_size & (fft_size - 1):
+			raise ValueError(f"fft size must be a power of two, got {fft_size}")
+		if not 0 <= overlap < 1:
+			raise ValueError(f"overlap must be in [0, 1), got {overlap}")
+		self.fft_size = fft_size
+		self.window_name = window
+		self.window = make_window(window, fft_size)
+		self.hop = max(1, int(fft_size * (1 - overlap)))
+		self.n_bins = fft_size // 2 + 1
+		self.rate = rate
+		self.channels = channels
+		self.freqs = np.fft.rfftfreq(fft_size, 1 / rate)
+		self.scale = 2 / np.sum(self.window)
+		self.floor = 10 ** (MIN_DB / 20)
+		self.frame = np.zeros((channels, fft_size))
+		self.channel_db = np.full((channels, self.n_bins), float(MIN_DB)) # spectrum of each channel
+		self.db = np.full(self.n_bins, float(MIN_DB))
+		self.position = 0 # ring sample count at the last analysed frame
+		self.bins = np.arange(self.n_bins)
+		self.bin_width = rate / fft_size
+		self.shift_hz = None # shift the interpolation below was set up for
+		self.shared_frames = 0 # shifter frame count at the last shared frame
+		self.frames = 0
+		self.cost_ns = 0 # cost of the last frame
+		self.avg_cost_ns = 0 # smoothed cost per frame
+
+	def shares(self, shifter):
+		return shifter.fft_size == self.fft_size and shifter.hop == self.hop and shifter.window_name == self.window_name and shifter.channels == self.channels
+
+	def shift(self, magnitude, hz):
+		# magnitude moved up by hz along its last axis, linear between bins and zero below the shifted first bin
+		if hz != self.shift_hz:
+			self.shift_hz = hz
+			position = self.bins - hz / self.bin_width
+			self.shift_lo = np.clip(np.floor(position).astype(np.intp), 0, self.n_bins - 2)
+			self.shift_weight = position - self.shift_lo
+			self.shift_outside = (position < 0) | (position > self.n_bins - 1)
+		out = magnitude[:, self.shift_lo] * (1 - self.shift_weight)
+		out += magnitude[:, self.shift_lo + 1] * self.shift_weight
+		out[:, self.shift_outside] = 0
+		return out
+
+	def update(self, ring, shifter=None, every_hop=False):
+		# returns True when a new frame was analysed
+		# while the shifter is active with the same framing its transform is reused: the output spectrum is
+		# the shifter input (already through distortion and gain) moved up by the shift
+		# every_hop analyses the frame one hop after the last one instead of the newest, so a caller that
+		# falls behind catches up frame by frame (unless the ring has already overwritten them)
+		spectrum = shifter.spectrum if shifter is not None and self.shares(shifter) else None
+		if spectrum is not None:
+			if shifter.frames == self.shared_frames:
+				return False
+			start = perf_counter_ns()
+			self.shared_frames = shifter.frames
+			magnitude = self.shift(np.abs(spectrum), shifter.hz)
+			self.position = ring.written
+		else:
+			written = ring.written
+			if written - self.position < self.hop:
+				return False
+			start = perf_counter_ns()
+			end = max(self.position + self.hop, written - ring.capacity + self.fft_size) if every_hop else written
+			ring.latest(self.fft_size, out=self.frame, end=end)
+			self.frame *= self.window
+			magnitude = np.abs(np.fft.rfft(self.frame))
+			self.position = end
+		magnitude *= self.scale
+		np.maximum(magnitude, self.floor, out=magnitude)
+		np.log10(magnitude, out=magnitude)
+		np.multiply(magnitude, 20, out=self.channel_db)
+		np.max(self.channel_db, axis=0, out=self.db)
+		self.frames += 1
+		self.cost_ns = perf_counter_ns() - start
+		self.avg_cost_ns += (self.cost_ns - self.avg_cost_ns) * 0.05
+		return True
+
+	def analyze_frames(self, frames):
+		# batched version of update for a 2-D array of frames (one per row), returns dBFS
+		spectra = np.abs(np.fft.rfft(frames * self.window, axis=1))
+		spectra *= self.scale
+		np.maximum(spectra, self.floor, out=spectra)
+		np.log10(spectra, out=spectra)
+		spectra *= 20
+		return spectra
+
+def parabolic(left, center, right):
+	# vertex of the parabola through three equally spaced points, as (offset from center in [-0.5, 0.5], height)
+	# works on arrays, flat tops give an offset of 0
+	curvature = left - 2 * center + right
+	offset = np.divide(0.5 * (left - right), curvature, out=np.zeros(np.shape(curvature)), where=curvature != 0)
+	offset = np.clip(offset, -0.5, 0.5)
+	return offset, center - 0.25 * (left - right) * offset
+
+# peaks and pitch from the raw analysis bins (not the screen columns), refined between bins by parabolic interpolation
+# the pitch is smoothed in cents and the note only changes once it is clearly past the next one, so labels don't flicker
+class PeakTracker:
+	def __init__(self, analyzer, mode=PITCH_MODE, count=PEAK_COUNT):
+		if mode not in ("peak", "hps", "autocorr"):
+			raise ValueError(f"unknown pitch mode '{mode}', expected peak, hps or autocorr")
+		self.mode = mode
+		self.count = count
+		self.fft_size = analyzer.fft_size
+		self.bin_width = analyzer.bin_width
+		self.rate = analyzer.bin_width * analyzer.fft_size
+		self.min_bin = max(1, int(np.ceil(PEAK_MIN_FREQ / self.bin_width)))
+		self.hps = np.empty(analyzer.n_bins // HPS_HARMONICS)
+		self.min_lag = max(2, int(self.rate / AUTOCORR_MAX_FREQ))
+		self.max_lag = min(int(self.rate / PEAK_MIN_FREQ), self.fft_size // 2)
+		self.power = np.empty(analyzer.n_bins)
+		self.peak_freqs = np.zeros(0) # loudest first
+		self.peak_dbs = np.zeros(0)
+		self.cents = None # smoothed pitch relative to a4
+		self.freq = 0
+		self.note = None # held midi note
+		self.quiet = PEAK_RELEASE
+		self.active = False
+
+	def find_peaks(self, db):
+		# local maxima above PEAK_MIN_DB, the loudest count of them refined between bins
+		inner = db[self.min_bin:-1]
+		is_peak = (inner > db[self.min_bin - 1:-2]) & (inner >= db[self.min_bin + 1:]) & (inner > PEAK_MIN_DB)
+		bins = np.flatnonzero(is_peak) + self.min_bin
+		if len(bins) > self.count:
+			bins = bins[np.argpartition(db[bins], -self.count)[-self.count:]]
+		offsets, levels = parabolic(db[bins - 1], db[bins], db[bins + 1])
+		order = np.argsort(levels)[::-1]
+		self.peak_freqs = (bins + offsets)[order] * self.bin_width
+		self.peak_dbs = levels[order]
+
+	def fundamental(self, db):
+		if self.mode == "peak":
+			return self.peak_freqs[0]
+		if self.mode == "hps":
+			# sum of the spectrum in dB decimated by 1..HPS_HARMONICS, the product of the magnitudes in log form
+			# only bins with some energy of their own can be the fundamental, otherwise every subharmonic of a pure tone ties with it
+			hps = self.hps
+			hps[:] = db[:len(hps)]
+			for h in range(2, HPS_HARMONICS + 1):
+				hps += db[:len(hps) * h:h]
+			hps[db[:len(hps)] < max(PEAK_MIN_DB, self.peak_dbs[0] - HPS_RANGE)] = -np.inf
+			k = int(np.argmax(hps[self.min_bin:-1])) + self.min_bin
+			if hps[k] == -np.inf:
+				return self.peak_freqs[0]
+			k += int(np.argmax(db[k - 1:k + 2])) - 1 # refined on the spectrum itself, around the local maximum
+			offset = parabolic(db[k - 1], db[k], db[k + 1])[0]
+			return (k + offset) * self.bin_width
+		# autocorrelation is the inverse transform of the power spectrum
+		np.multiply(db, 0.1, out=self.power)
+		np.power(10, self.power, out=self.power)
+		acf = np.fft.irfft(self.power, n=self.fft_size)[:self.max_lag + 1]
+		lags = acf[self.min_lag:self.max_lag]
+		is_peak = (lags > acf[self.min_lag - 1:self.max_lag - 1]) & (lags >= acf[self.min_lag + 1:self.max_lag + 1])
+		candidates = np.flatnonzero(is_peak)
+		if len(candidates) == 0:
+			return self.peak_freqs[0]
+		best = lags[candidates].max()
+		k = candidates[np.argmax(lags[candidates] >= AUTOCORR_RATIO * best)] + self.min_lag
+		offset = parabolic(acf[k - 1], acf[k], acf[k + 1])[0]
+		return self.rate / (k + offset)
+
+	def update(self, db):
+		# call once per analysed frame with the analyzer's dBFS spectrum
+		self.find_peaks(db)
+		if len(self.peak_freqs) == 0:
+			self.quiet += 1
+			if self.quiet >= PEAK_RELEASE:
+				self.active = False
+				self.cents = None
+			return
+		self.quiet = 0
+		self.active = True
+		freq = self.fundamental(db)
+		if freq <= 0:
+			return
+		cents = 1200 * log2(freq / 440)
+		if self.cents is None or abs(cents - self.cents) > PEAK_JUMP:
+			self.cents = cents
+		else:
+			self.cents += (cents - self.cents) * PEAK_SMOOTHING
+		self.freq = 440 * 2 ** (self.cents / 1200)
+		midi = self.cents / 100 + 69
+		if self.note is None or abs(midi - self.note) > 0.5 + PEAK_HYSTERESIS / 100:
+			self.note = int(round(midi))
+
+	def note_freq(self):
+		# centre frequency of the held note, for note_equivalent
+		return 440 * 2 ** ((self.note - 69) / 12) if self.note is not None else 0
+
+# ---------------------------- AUDIO ENGINE ---------------------------- #
+# single producer / single consumer ring of processed samples, preallocated once, one row per channel
+# the audio callback is the only writer, the ui thread is the only reader
+class RingBuffer:
+	def __init__(self, capacity, dtype=np.float64, channels=1):
+		self.capacity = capacity
+		self.channels = channels
+		self.buffer = np.zeros((channels, capacity), dtype=dtype)
+		self.written = 0 # total frames ever written, only advanced after the copy is done
+
+	def write(self, data):
+		# data is (channels, frames), or 1-D for the same samples in every channel
+		n = data.shape[-1]
+		if n > self.capacity:
+			data = data[..., -self.capacity:]
+			self.written += n - self.capacity
+			n = self.capacity
+		start = self.written % self.capacity
+		end = start + n
+		if end <= self.capacity:
+			self.buffer[:, start:end] = data
+		else:
+			split = self.capacity - start
+			self.buffer[:, start:] = data[..., :split]
+			self.buffer[:, :end - self.capacity] = data[..., split:]
+		self.written += n
+
+	def latest(self, n, out=None, end=None):
+		# newest n frames of every channel in chronological order, as (channels, n)
+		# or the n frames before end, a total frame count that is still in the ring
+		if out is None:
+			out = np.empty((self.channels, n), dtype=self.buffer.dtype)
+		end = (self.written if end is None else end) % self.capacity
+		start = end - n
+		if start >= 0:
+			out[:] = self.buffer[:, start:end]
+		else:
+			out[..., :-start] = self.buffer[:, start:]
+			out[..., -start:] = self.buffer[:, :end]
+		return out
+
+PA_FORMATS = {"int16": paInt16, "int24": paInt24, "int32": paInt32, "float32": paFloat32} # stream format of each sample format
+
+# runs capture -> effects chain -> output in the pyaudio callback thread
+# the ui sets the control attributes and reads processed samples back from the ring
+# while the input (frozen, or silence with the mic off) and the knobs stay the same, the last processed block is
+# replayed without running the chain or touching the ring, so the ui has no new frame to analyse or draw either
+# a shift between whole bins doesn't repeat every block, so it is always processed, and so is a chain with
+# stages that aren't known to repeat (see EffectsChain.replayable)
+class AudioEngine:
+	def __init__(self, rate=RATE, buffer=BUFFER, channels=CHANNELS, sample_format=SAMPLE_FORMAT, device=DEVICE, output_device=OUTPUT_DEVICE, output=True, ring_size=RING_SIZE, backend=PyAudio):
+		if sample_format not in SAMPLE_FORMATS:
+			raise ValueError(f"unknown sample format '{sample_format}', expected one of {', '.join(SAMPLE_FORMATS)}")
+		self.backend = backend # anything with the PyAudio interface, swapped out by benchmark.py
+		self.rate = rate
+		self.buffer = buffer
+		self.channels = channels
+		self.sample_format = sample_format
+		self.device = device
+		self.output_device = output_device
+		self.output = output # False to only capture
+		self.ring = RingBuffer(max(buffer * ring_size, 2 * FFT_SIZE), dtype=np.float32, channels=channels) # room for at least two analysis windows
+		self.silence = bytes(buffer * channels * SAMPLE_FORMATS[sample_format][0])
+		self.data = self.silence
+		self.blocks = 0
+		self.version = -1 # identifies self.data, -1 is silence
+		self.key = None # input version and knobs of the last processed block
+		self.repeats = 0 # blocks processed with the same key
+		self.settle_blocks = -(-(2 * SHIFT_FFT_SIZE + FFT_SIZE) // buffer) # until then older audio is still in the shifter history and tail, or the analysis window
+		self.out_data = self.silence # output of the last processed block
+		self.reused = 0 # blocks replayed instead of processed
+		self.mic = True
+		self.mute = False
+		self.freeze = False
+		self.dist = 1
+		self.shift = SHIFT_MAX/2
+		self.gain = 1
+		self.chain = EffectsChain(rate, buffer, channels, sample_format)
+		self.shifter = self.chain.shifter
+		self.recorder = None # receives every processed block while recording
+		self.profiler = None
+		self.xruns = {"input_overflow": 0, "input_underflow": 0, "output_overflow": 0, "output_underflow": 0}
+		self.pyaudio = None
+		self.stream = None
+
+	def start(self):
+		self.pyaudio = self.backend()
+		self.stream = self.pyaudio.open(format=PA_FORMATS[self.sample_format], channels=self.channels, rate=self.rate, input=True, output=self.output,
+			input_device_index=self.device, output_device_index=self.output_device if self.output else None, frames_per_buffer=self.buffer, stream_callback=self.callback)
+		self.stream.start_stream()
+
+	def close(self):
+		if self.stream is not None:
+			self.stream.stop_stream()
+			self.stream.close()
+			self.stream = None
+		if self.pyaudio is not None:
+			self.pyaudio.terminate()
+			self.pyaudio = None
+
+	def total_xruns(self):
+		return sum(self.xruns.values())
+
+	def callback(self, in_data, frame_count, time_info, status):
+		start = perf_counter_ns()
+		if status:
+			if status & paInputOverflow: self.xruns["input_overflow"] += 1
+			if status & paInputUnderflow: self.xruns["input_underflow"] += 1
+			if status & paOutputOverflow: self.xruns["output_overflow"] += 1
+			if status & paOutputUnderflow: self.xruns["output_underflow"] += 1
+		self.blocks += 1
+		if not self.freeze: # freeze the spectrum (and audio)
+			self.data = in_data if self.mic else self.silence
+			self.version = self.blocks if self.mic else -1
+		key = (self.version, self.dist, self.gain, self.shift)
+		self.repeats = self.repeats + 1 if key == self.key else 0
+		self.key = key
+		profiler = self.profiler
+		if self.repeats >= self.settle_blocks and shift_is_periodic(self.shift) and self.chain.replayable(): # nothing changed, replay the last block
+			self.reused += 1
+			recorder = self.recorder
+			if recorder is not None:
+				recorder.push(self.chain.buffer)
+			if profiler is not None:
+				profiler.record("callback", perf_counter_ns() - start)
+			return (self.silence if self.mute else self.out_data, paContinue)
+
+		# effects chain
+		self.chain.dist_gain.amount = self.dist
+		self.chain.dist_gain.gain = self.gain
+		self.shifter.set_shift(shift_to_hz(self.shift, self.rate, self.buffer))
+		audio_data, self.out_data = self.chain.process(self.data, self.version)
+		effects_done = perf_counter_ns()
+		self.ring.write(audio_data)
+		recorder = self.recorder
+		if recorder is not None:
+			recorder.push(audio_data)
+
+		if profiler is not None:
+			profiler.record("effects", effects_done - start)
+			profiler.record("callback", perf_counter_ns() - start)
+		return (self.silence if self.mute else self.out_data, paContinue)
+
+# ---------------------------- RECORDER ---------------------------- #
+# wav file written incrementally, the sizes in the header are patched on close
+class WavWriter:
+	def __init__(self, filename, rate, channels=1, sample_format="int16"):
+		if sample_format not in SAMPLE_FORMATS:
+			raise ValueError(f"unsupported recording format '{sample_format}'")
+		self.filename = filename
+		self.float = sample_format == "float32"
+		bits = SAMPLE_FORMATS[sample_format][0] * 8
+		block_align = channels * bits // 8
+		self.file = open(filename, "wb")
+		self.file.write(struct.pack("<4sI4s", b"RIFF", 0, b"WAVE"))
+		if self.float: # ieee float needs the extended fmt chunk and a fact chunk
+			self.file.write(struct.pack("<4sIHHIIHHH", b"fmt ", 18, 3, channels, rate, rate * block_align, block_align, bits, 0))
+			self.fact_offset = self.file.tell() + 8
+			self.file.write(struct.pack("<4sII", b"fact", 4, 0))
+		else:
+			self.file.write(struct.pack("<4sIHHIIHH", b"fmt ", 16, 1, channels, rate, rate * block_align, block_align, bits))
+		self.data_offset = self.file.tell() + 4
+		self.file.write(struct.pack("<4sI", b"data", 0))
+		self.block_align = block_align
+		self.bytes_written = 0
+
+	def write(self, data):
+		# interleaved sample bytes
+		self.file.write(data)
+		self.bytes_written += len(data)
+
+	def reserve(self, n_frames):
+		# grows the data chunk without writing it, so it can be filled through a memmap
+		if self.bytes_written + n_frames * self.block_align > WAV_MAX_BYTES:
+			raise ValueError(f"{n_frames} frames don't fit in a .wav file")
+		self.file.truncate(self.file.tell() + n_frames * self.block_align)
+		self.file.seek(0, 2)
+		self.bytes_written += n_frames * self.block_align
+
+	def close(self):
+		end = self.file.tell()
+		self.file.seek(4)
+		self.file.write(struct.pack("<I", end - 8))
+		if self.float:
+			self.file.seek(self.fact_offset)
+			self.file.write(struct.pack("<I", self.bytes_written // self.block_align))
+		self.file.seek(self.data_offset)
+		self.file.write(struct.pack("<I", self.bytes_written))
+		self.file.close()
+
+# streams blocks from the audio callback through a bounded queue to a writer thread
+# memory use is fixed by RECORD_QUEUE no matter how long the recording runs
+class Recorder:
+	def __init__(self, rate=RATE, channels=1, sample_format=RECORD_FORMAT or SAMPLE_FORMAT, rotate_seconds=RECORD_ROTATE_SECONDS, rotate_bytes=RECORD_ROTATE_BYTES, directory="out"):
+		if sample_format not in SAMPLE_FORMATS:
+			raise ValueError(f"unsupported recording format '{sample_format}'")
+		self.rate = rate
+		self.channels = channels
+		self.sample_format = sample_format
+		self.rotate_bytes = rotate_bytes
+		if rotate_seconds:
+			seconds_bytes = int(rotate_seconds * rate) * channels * SAMPLE_FORMATS[sample_format][0]
+			self.rotate_bytes = min(self.rotate_bytes, seconds_bytes) if self.rotate_bytes else seconds_bytes
+		self.rotate_bytes = min(self.rotate_bytes or WAV_MAX_BYTES, WAV_MAX_BYTES) # multi hour sessions would outgrow one file
+		self.directory = directory
+		self.queue = Queue(maxsize=RECORD_QUEUE)
+		self.lock = threading.Lock()
+		self.active = False
+		self.dropped = 0 # blocks lost because the writer fell behind
+		self.error = None # what stopped the writer early, disk full for example
+		self.files = []
+
+	def start(self):
+		if not path.exists(self.directory):
+			makedirs(self.directory)
+		timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+		self.base_name = f'{self.directory}/recorded_audio_{timestamp}'
+		self.writer = self.open_next() # opened here so a bad path fails before recording starts
+		self.active = True
+		self.thread = threading.Thread(target=self.run, name="recorder", daemon=True)
+		self.thread.start()
+
+	def push(self, block):
+		# called from the audio callback with the (channels, frames) float32 block, never blocks
+		block = encode_samples(block, self.sample_format)
+		with self.lock:
+			if not self.active:
+				return
+			try:
+				self.queue.put_nowait(block)
+			except Full:
+				self.dropped += 1
+
+	def stop(self):
+		# waits until every queued block is on disk, returns the written file names
+		with self.lock:
+			self.active = False
+		while self.thread.is_alive(): # a writer that died can't make room in a full queue, so never wait on it for long
+			try:
+				self.queue.put(None, timeout=0.1)
+				break
+			except Full:
+				pass
+		self.thread.join()
+		if self.error is not None:
+			print(f"Recording to {self.files[-1]} stopped early: {self.error}")
+		if self.dropped:
+			print(f"Recording to {self.files[-1]} dropped {self.dropped} blocks because the writer fell behind")
+		return self.files
+
+	def open_next(self):
+		suffix = f"_{len(self.files):03d}" if self.files else ""
+		filename = f"{self.base_name}{suffix}.wav"
+		self.files.append(filename)
+		return WavWriter(filename, self.rate, self.channels, self.sample_format)
+
+	def run(self):
+		block = b""
+		try:
+			while True:
+				block = self.queue.get()
+				if block is None:
+					break
+				if self.rotate_bytes and self.writer.bytes_written + len(block) > self.rotate_bytes and self.writer.bytes_written:
+					self.writer.close()
+					self.writer = self.open_next()
+				self.writer.write(block)
+			self.writer.close()
+		except OSError as error: # the recording ends here, the queue is still drained until stop so it never blocks
+			self.error = error
+			with self.lock:
+				self.active = False
+			try:
+				self.writer.close() # keeps what made it to disk readable when the header can still be written
+			except (OSError, ValueError):
+				pass
+			while block is not None:
+				block = self.queue.get()
+
+# ---------------------------- PUBLISHER ---------------------------- #
+# shares every analysed frame with other local processes, see spectrumclient.py for the layout and the readers
+# writes never wait on a reader: shared memory slots are simply overwritten and datagrams dropped when nobody keeps up
+class SpectrumPublisher:
+	def __init__(self, analyzer, name=None, udp=None, unix=None, slots=SLOTS):
+		self.seq = 0
+		self.shm = None
+		self.name = name # the name actually used, see below
+		if name is not None:
+			size = shm_size(analyzer.n_bins, slots)
+			try:
+				self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+			except FileExistsError: # most likely another instance publishing, its ring is never touched
+				self.name = f"{name}-{getpid()}"
+				self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+			self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+			self.slots = np.ndarray((slots,), dtype=slot_dtype(analyzer.n_bins), buffer=self.shm.buf, offset=HEADER_SIZE)
+			self.slots["seq"] = 0
+			self.header["n_bins"] = analyzer.n_bins
+			self.header["slots"] = slots
+			self.header["fft_size"] = analyzer.fft_size
+			self.header["rate"] = analyzer.bin_width * analyzer.fft_size
+			self.header["seq"] = 0
+			self.header["version"] = VERSION
+			self.header["magic"] = MAGIC # written last, readers check it first
+
+		self.targets = [] # (socket, address) every datagram is sent to
+		for family, address in ((socket.AF_INET, udp), (getattr(socket, "AF_UNIX", None), unix)):
+			if address is not None:
+				target = socket.socket(family, socket.SOCK_DGRAM)
+				target.setblocking(False)
+				self.targets.append((target, address))
+		if self.targets:
+			self.packet = bytearray(PACKET_DTYPE.itemsize + 2 * analyzer.n_bins)
+			self.packet_header = np.ndarray((), dtype=PACKET_DTYPE, buffer=self.packet)
+			self.packet_header["magic"] = MAGIC
+			self.packet_header["n_bins"] = analyzer.n_bins
+			self.packet_spectrum = np.ndarray((analyzer.n_bins,), dtype="<f2", buffer=self.packet, offset=PACKET_DTYPE.itemsize)
+		self.dropped = 0 # datagrams nobody was there to take
+		self.thread = None
+		self.running = threading.Event()
+
+	def follow(self, engine, analyzer, tracker):
+		# publishes every hop of the engine's ring from a thread with its own analyzer and tracker,
+		# so readers get every frame whatever the ui frame rate (or with the window in the background)
+		self.running.set()
+		self.thread = threading.Thread(target=self.run, args=(engine, analyzer, tracker), name="publisher", daemon=True)
+		self.thread.start()
+
+	def run(self, engine, analyzer, tracker):
+		poll = analyzer.hop / engine.rate / 4
+		while self.running.is_set():
+			if analyzer.update(engine.ring, every_hop=True):
+				tracker.update(analyzer.db)
+				if tracker.active:
+					self.publish(analyzer.db, tracker.freq, note_equivalent(tracker.note_freq())[1], time())
+				else:
+					self.publish(analyzer.db, 0, "", time())
+			else:
+				sleep(poll)
+
+	def publish(self, spectrum, peak_freq, note, timestamp):
+		self.seq += 1
+		note = note.encode()
+		if self.shm is not None:
+			# the slot's seq is cleared while it is rewritten, so a reader holding a view of it can tell
+			i = self.seq % len(self.slots)
+			slots = self.slots
+			slots["seq"][i] = 0
+			slots["timestamp"][i] = timestamp
+			slots["peak_freq"][i] = peak_freq
+			slots["note"][i] = note
+			slots["spectrum"][i] = spectrum
+			slots["seq"][i] = self.seq
+			self.header["seq"] = self.seq
+		if self.targets:
+			header = self.packet_header
+			header["seq"] = self.seq
+			header["timestamp"] = timestamp
+			header["peak_freq"] = peak_freq
+			header["note"] = note
+			self.packet_spectrum[:] = spectrum
+			for target, address in self.targets:
+				try:
+					target.sendto(self.packet, address)
+				except OSError: # full buffer, or no one listening
+					self.dropped += 1
+
+	def close(self):
+		if self.thread is not None:
+			self.running.clear()
+			self.thread.join()
+			self.thread = None
+		if self.shm is not None:
+			self.header = self.slots = None # views must go before the memory can be closed
+			self.shm.close()
+			self.shm.unlink()
+			self.shm = None
+		for target, address in self.targets:
+			target.close()
+		self.targets = []
+
+# ---------------------------- PROFILER ---------------------------- #
+# rolling window of timings per stage of the main loop and the audio callback, cheap enough to leave on
+# every stage has its own ring written by one thread only, percentiles are computed when they are read
+PROFILE_STAGES = ("callback", "effects", "analysis", "axis", "spectrum", "hud", "controls", "display", "events", "idle", "frame")
+
+class Profiler:
+	def __init__(self, stages=PROFILE_STAGES, window=PROFILE_WINDOW):
+		self.window = window
+		self.timings = {name: np.zeros(window, dtype=np.int64) for name in stages}
+		self.counts = dict.fromkeys(stages, 0)
+		self.last = perf_counter_ns()
+
+	def record(self, name, ns):
+		count = self.counts[name]
+		self.timings[name][count % self.window] = ns
+		self.counts[name] = count + 1
+
+	def mark(self):
+		self.last = perf_counter_ns()
+
+	def lap(self, name, keep=True):
+		# time since the previous mark or lap, only recorded when keep is set
+		now = perf_counter_ns()
+		if keep:
+			self.record(name, now - self.last)
+		self.last = now
+
+	def percentiles(self):
+		# {stage: (p50, p95, p99) in ms} for stages that have run
+		result = {}
+		for name, timings in self.timings.items():
+			count = min(self.counts[name], self.window)
+			if count:
+				result[name] = tuple(np.percentile(timings[:count], (50, 95, 99)) / 1e6)
+		return result
+
+	def export(self, filename, xruns):
+		timestamp = time()
+		stats = self.percentiles()
+		if filename.endswith(".csv"):
+			new_file = not path.exists(filename)
+			with open(filename, "a") as f:
+				if new_file:
+					f.write("timestamp,stage,p50_ms,p95_ms,p99_ms,count\n")
+				for name, (p50, p95, p99) in stats.items():
+					f.write(f"{timestamp:.3f},{name},{p50:.4f},{p95:.4f},{p99:.4f},{self.counts[name]}\n")
+				for name, count in xruns.items():
+					f.write(f"{timestamp:.3f},{name},,,,{count}\n")
 		else:
-			output_file = np.append(output_file, np.int16(audio_data)/(RATE/4))
-	elif output_file is not None:
-		frame_index = 0
-		out_file_name = save_file(output_file)
-		output_file = None
-	if out_file_name is not None:
-		save_confirmation(screen, out_file_name)
-	if not mute_button.value:
-		out_stream.write(np.int16(audio_data).tobytes())
-
-	# ---------------------------- UI ---------------------------- #
-	# mic on/off indicator
-	if mic_button.value: mode_string = "MIC ON"
-	else: mode_string = "MIC OFF"
-	mode_text = font_medium.render(mode_string, True, FONT_COLOR)
-	screen.blit(mode_text, (info.current_w - (mode_text.get_width() + (SCALE * 10)),  (SCALE * 10)))
-
-	# only shows mouse cursor if in window
-	mouse_pos = pygame.mouse.get_pos()
-	try: 
-		if mouse_pos[1] < spectrum_h_range:
-			mouse_freq, mouse_note = note_equivalent(note_map, int(freqs[mouse_pos[0]]))
-			pygame.draw.line(screen, CH_COLOR, (mouse_pos[0], 0), (mouse_pos[0], spectrum_h_range), 1)
-			freq_text = font_small.render(f"{mouse_freq} Hz", True, FONT_COLOR)
-			screen.blit(freq_text, (max(mouse_pos[0] - freq_text.get_width() - 15, 0 + (SCALE * 10)), max(mouse_pos[1] - (SCALE * 10), SCALE * 75)))
-			note_text = font_tiny.render(f"{mouse_note}", True, FONT_COLOR)
-			screen.blit(note_text, (max(mouse_pos[0] - note_text.get_width() - 15, 0 + (SCALE * 10)), max(mouse_pos[1] - (SCALE * 10), SCALE * 75) + freq_text.get_height()))
-	except IndexError:
-		pass
-
-	# peak freq indicator
-	peak_freq_text = font_small.render(f"{int(peak_freq)} Hz", True, FONT_COLOR)
-	peak_note_text = font_small.render(f"{peak_notename}", True, FONT_COLOR)
-	temp_peak_freq = freqs[np.argmax(dp_spectrum)]
-	if np.max(dp_spectrum) > 30 and temp_peak_freq > 60: # filter out low freq and low amplitude noise
-		peak_freq, peak_notename = note_equivalent(note_map, temp_peak_freq)
-		peak_freq_text = font_small.render(f"{int(peak_freq)} Hz", True, FONT_COLOR_ACCENT)
-		peak_note_text = font_small.render(f"{peak_notename}", True, FONT_COLOR_ACCENT)
-		screen.blit(peak_freq_text, (info.current_w - (peak_freq_text.get_width() + (SCALE * 10)), (SCALE * 35)))
-		screen.blit(peak_note_text, (info.current_w - (peak_note_text.get_width() + (SCALE * 10)), (SCALE * 55)))
-	else: 
-		screen.blit(peak_freq_text, (info.current_w - (peak_freq_text.get_width() + (SCALE * 10)), (SCALE * 35)))
-		screen.blit(peak_note_text, (info.current_w - (peak_note_text.get_width() + (SCALE * 10)), (SCALE * 55)))
-
-	# keybind popup
-	if show_keybinds: draw_keybinds(screen)	
-
-	# draw control bar
-	pygame.draw.rect(screen, CTRL_BAR_COLOR, (0, info.current_h - UNIT, info.current_w, UNIT))
-	pygame.draw.line(screen, TIERTIARY_COLOR, (0, (info.current_h - UNIT) + 1), (info.current_w + 1, info.current_h - UNIT + 1), 2)
-
-	radius = UNIT/3
-	gap = radius*2.5
-
-	# draw buttons and knobs
-	view_button.draw(screen, UNIT/2, (info.current_h - UNIT/2), radius)
-	mic_button.draw(screen, UNIT/2 + gap, (info.current_h - UNIT/2), radius)
-	mute_button.draw(screen, UNIT/2 + gap*2, (info.current_h - UNIT/2), radius)
-	freeze_button.draw(screen, UNIT/2 + gap*3, info.current_h - UNIT/2, radius)
-	record_button.draw(screen, UNIT/2 + gap*4, info.current_h - UNIT/2, radius)
-	freq_shift_knob.draw(screen, info.current_w - UNIT/2 - gap*2, (info.current_h - UNIT/2), radius)
-	dist_knob.draw(screen, info.current_w - UNIT/2 - gap, (info.current_h - UNIT/2), radius)
-	gain_knob.draw(screen, info.current_w - UNIT/2, (info.current_h - UNIT/2), radius)
-
-	# ---------------------------- EVENTS ---------------------------- #
-	pygame.display.flip()
-	for event in pygame.event.get():
-
-		mouse_pos = pygame.mouse.get_pos()
-		gain_knob.handle_event(event, mouse_pos)
-		dist_knob.handle_event(event, mouse_pos)
-		freq_shift_knob.handle_event(event, mouse_pos)
-		mute_button.handle_event(event, mouse_pos)
-		mic_button.handle_event(event, mouse_pos)
-		view_button.handle_event(event, mouse_pos)
-		freeze_button.handle_event(event, mouse_pos)
-		record_button.handle_event(event, mouse_pos)
-
-		if event.type == pygame.QUIT:
-			if record_button.value:
+			snapshot = {
+				"timestamp": timestamp,
+				"stages": {name: {"p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "count": self.counts[name]} for name, (p50, p95, p99) in stats.items()},
+				"xruns": dict(xruns),
+			}
+			with open(filename, "a") as f:
+				f.write(json.dumps(snapshot) + "\n")
+
+# time spent in each startup stage, printed once with --startup-profile
+STARTUP_STAGES = [("imports", IMPORT_END - IMPORT_START)]
+
+def startup_stage(name, start):
+	# records the time since start, returns now so stages can be chained
+	now = perf_counter_ns()
+	STARTUP_STAGES.append((name, now - start))
+	return now
+
+def print_startup_profile():
+	print(f"{'stage':<24}{'ms':>10}")
+	for name, ns in STARTUP_STAGES:
+		print(f"{name:<24}{ns / 1e6:>10.1f}")
+	print(f"{'since first import':<24}{(perf_counter_ns() - IMPORT_START) / 1e6:>10.1f}")
+
+def draw_profiler(surface, profiler, lines):
+	# stage table with right aligned columns under the peak readout, then free text lines
+	right, y = surface.get_width() - SCALE * 10, SCALE * 95
+	columns = [right - SCALE * 90, right - SCALE * 45, right]
+	x = right - SCALE * 210
+	draw_text(surface, "STAGE (ms)", FONT_XTINY, x, y, color=FONT_COLOR_ACCENT, align="left")
+	for column, title in zip(columns, ("p50", "p95", "p99")):
+		draw_text(surface, title, FONT_XTINY, column, y, color=FONT_COLOR_ACCENT, align="right")
+	for name, values in profiler.percentiles().items():
+		y += SCALE * 13
+		draw_text(surface, name, FONT_XTINY, x, y, color=FONT_COLOR, align="left")
+		for column, value in zip(columns, values):
+			draw_text(surface, f"{value:.2f}", FONT_XTINY, column, y, color=FONT_COLOR, align="right")
+	y += SCALE * 6
+	for text, color in lines:
+		y += SCALE * 13
+		draw_text(surface, text, FONT_XTINY, x, y, color=color, align="left")
+
+# ---------------------------- BATCH ---------------------------- #
+# offline processing of a .wav file through the same effects chain and analysis as the live view
+# the input is memory mapped and split into chunks of whole buffers, optionally across processes
+def read_wav(filename):
+	# sample rate and a memmap of the samples, scipy can't memmap 24 bit files so their packed samples
+	# are mapped as 3 byte items (V3) that to_float widens a chunk at a time
+	from scipy.io.wavfile import read
+	with open(filename, "rb") as f:
+		riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+		bits = None
+		while riff == b"RIFF" and wave == b"WAVE":
+			header = f.read(8)
+			if len(header) < 8:
+				break
+			chunk, size = struct.unpack("<4sI", header)
+			if chunk == b"fmt ":
+				_, channels, rate, _, _, bits = struct.unpack("<HHIIHH", f.read(16))
+				f.seek(size - 16 + size % 2, 1)
+			elif chunk == b"data" and bits == 24:
+				n_frames = size // (3 * channels)
+				return rate, np.memmap(filename, dtype=np.dtype("V3"), mode="r", offset=f.tell(), shape=(n_frames, channels) if channels > 1 else (n_frames,))
+			else:
+				f.seek(size + size % 2, 1)
+	return read(filename, mmap=True)
+
+def to_float(data):
+	# any .wav sample type to floats with full scale at 1, like the live stream
+	if data.dtype.kind == "V": # packed 24 bit samples, moved into the top of an int32 like decode_samples does
+		widened = np.zeros(data.shape + (4,), dtype=np.uint8)
+		widened[..., 1:] = np.ascontiguousarray(data).view(np.uint8).reshape(data.shape + (3,))
+		return widened.view(np.int32)[..., 0] / 2 ** 31
+	if data.dtype == np.uint8:
+		return (data.astype(np.float64) - 128) / 128
+	if np.issubdtype(data.dtype, np.integer):
+		return data.astype(np.float64) / 2 ** (8 * data.itemsize - 1)
+	return data.astype(np.float64)
+
+def batch_chunk(task):
+	# processes buffers [first, last) and the frames that start in them, writes straight into the output memmaps
+	job, first, last = task
+	rate, data = read_wav(job["input"])
+	analyzer = SpectrumAnalyzer(job["fft_size"], job["window"], job["overlap"], rate)
+	n_samples, n_frames = job["n_samples"], job["n_frames"]
+
+	# frames starting in this chunk, and the buffers they need past its end
+	frame_first = -(-first * BUFFER // analyzer.hop)
+	frame_last = min(-(-last * BUFFER // analyzer.hop), n_frames)
+	end = max(last * BUFFER, (frame_last - 1) * analyzer.hop + analyzer.fft_size)
+	n_blocks = -(-end // BUFFER) - first
+
+	# effects chain, with enough pre-roll for the shifter to reach the state a continuous run would have
+	# and its latency processed past the end, then dropped from the start, so the output lines up with the input
+	start = first * BUFFER
+	shifter = FrequencyShifter(rate, shift_to_hz(job["shift"], rate))
+	preroll = min(start, -(-2 * shifter.fft_size // BUFFER) * BUFFER)
+	latency = shifter.latency # a multiple of hop, like the rest of the length
+	processed = np.zeros(preroll + n_blocks * BUFFER + latency, dtype=np.float32)
+	chunk = to_float(data[start - preroll:min(start + n_blocks * BUFFER + latency, n_samples)])
+	if chunk.ndim > 1: # mix down to mono
+		chunk = chunk.mean(axis=1)
+	processed[:len(chunk)] = chunk
+	dist_gain_fx(processed, job["dist"], job["gain"])
+	shifter.reset(start - preroll)
+	processed = shifter.process(processed)[preroll + latency:]
+	if n_samples - start < len(processed): # past the end of the file is silence
+		processed[n_samples - start:] = 0
+
+	own = min(last * BUFFER, n_samples) - start
+	audio = np.memmap(job["wav"], dtype="<f4", mode="r+", offset=job["wav_offset"], shape=(n_samples,))
+	audio[start:start + own] = processed[:own] # float, so nothing past full scale is clipped
+	audio.flush()
+
+	# strided view of every frame, analysed as one batched rfft
+	offset = frame_first * analyzer.hop - start
+	frames = np.lib.stride_tricks.sliding_window_view(processed[offset:], analyzer.fft_size)[::analyzer.hop][:frame_last - frame_first]
+	spectra = analyzer.analyze_frames(frames)
+	if job["spectrogram"] is not None:
+		spectrogram = np.load(job["spectrogram"], mmap_mode="r+")
+		spectrogram[frame_first:frame_last] = spectra
+		spectrogram.flush()
+	first_bin = max(1, int(np.argmax(analyzer.freqs >= MIN_FREQ)))
+	peak_bins = np.argmax(spectra[:, first_bin:-1], axis=1) + first_bin
+	rows = np.arange(len(spectra))
+	offsets, peak_dbs = parabolic(spectra[rows, peak_bins - 1], spectra[rows, peak_bins], spectra[rows, peak_bins + 1])
+	return frame_first, (peak_bins + offsets) * analyzer.bin_width, peak_dbs
+
+def run_batch(args):
+	begin = perf_counter_ns()
+	try:
+		rate, data = read_wav(args.batch)
+	except (ValueError, struct.error) as error: # not a .wav file, or one that is cut short
+		sys.exit(f"can't read {args.batch}: {error}")
+	n_samples = len(data)
+	n_buffers = -(-n_samples // BUFFER)
+	analyzer = SpectrumAnalyzer(rate=rate)
+	n_frames = max(1, -(-n_buffers * BUFFER // analyzer.hop))
+	max_samples = WAV_MAX_BYTES // SAMPLE_FORMATS["float32"][0]
+	if n_samples > max_samples: # checked before any output exists
+		sys.exit(f"{args.batch} is too long for one processed .wav file ({max_samples / rate / 3600:.1f} hours at most), split it first")
+	if not path.exists(args.out):
+		makedirs(args.out)
+	name = path.join(args.out, path.splitext(path.basename(args.batch))[0])
+
+	# outputs are preallocated so every chunk writes its own slice
+	writer = WavWriter(f"{name}_processed.wav", rate, sample_format="float32")
+	writer.reserve(n_samples)
+	wav_offset = writer.data_offset + 4
+	writer.close()
+	job = {
+		"input": args.batch, "wav": f"{name}_processed.wav", "wav_offset": wav_offset, "spectrogram": None,
+		"n_samples": n_samples, "n_frames": n_frames, "fft_size": analyzer.fft_size, "window": analyzer.window_name, "overlap": OVERLAP,
+		"dist": args.dist, "shift": args.shift + SHIFT_MAX/2, "gain": args.gain,
+	}
+	if args.spectrogram == "npy":
+		job["spectrogram"] = f"{name}_spectrogram.npy"
+		np.lib.format.open_memmap(job["spectrogram"], mode="w+", dtype=np.float32, shape=(n_frames, analyzer.n_bins)).flush()
+
+	chunk = BATCH_CHUNK
+	if args.workers > 1: # enough chunks to keep every worker busy
+		chunk = max(1, min(chunk, -(-n_buffers // (args.workers * 4))))
+	tasks = [(job, first, min(first + chunk, n_buffers)) for first in range(0, n_buffers, chunk)]
+	peak_freqs = np.zeros(n_frames)
+	peak_dbs = np.zeros(n_frames)
+	if args.workers > 1:
+		with Pool(args.workers) as pool:
+			results = list(pool.imap_unordered(batch_chunk, tasks))
+	else:
+		results = map(batch_chunk, tasks)
+	for frame_first, freqs, dbs in results:
+		peak_freqs[frame_first:frame_first + len(freqs)] = freqs
+		peak_dbs[frame_first:frame_first + len(dbs)] = dbs
+
+	if args.spectrogram == "csv":
+		notes = np.where(peak_dbs > MIN_DB, note_names(peak_freqs), "")
+		with open(f"{name}_peaks.csv", "w") as f:
+			f.write("time_s,peak_hz,peak_db,note\n")
+			for i, (freq, db, note) in enumerate(zip(peak_freqs, peak_dbs, notes)):
+				f.write(f"{i * analyzer.hop / rate:.6f},{freq:.2f},{db:.2f},{note}\n")
+
+	elapsed = (perf_counter_ns() - begin) / 1e9
+	duration = n_samples / rate
+	print(f"Processed {duration:.2f} s of audio ({n_frames} frames) in {elapsed:.2f} s, {duration / elapsed:.1f}x real time")
+	print(f"Saved {name}_processed.wav and {name}_{'spectrogram.npy' if args.spectrogram == 'npy' else 'peaks.csv'}")
+
+# ---------------------------- MONITOR ---------------------------- #
+# --devices mode: every input device is captured, processed and analysed by its own worker process, so the dsp
+# spreads across cores and never shares a GIL with the ui. a worker publishes its frames to its own shared memory
+# ring (the spectrumclient layout) and reads its knobs from a small shared array. the ui only looks at the newest
+# frame of each ring, so a stalled device or worker leaves its pane on the last spectrum instead of blocking
+SLOT_MIC, SLOT_FREEZE, SLOT_DIST, SLOT_SHIFT, SLOT_GAIN, SLOT_RUNNING, SLOT_BLOCKS = range(7) # shared array of each worker
+
+def monitor_worker(index, device, settings, name, shared, errors):
+	# runs in the worker process until the ui clears SLOT_RUNNING
+	engine = publisher = None
+	try:
+		warm_kernels(settings["format"])
+		engine = AudioEngine(settings["rate"], settings["buffer"], settings["channels"], settings["format"], device, output=False)
+		analyzer = SpectrumAnalyzer(rate=engine.rate, channels=engine.channels)
+		tracker = PeakTracker(analyzer, mode=settings["pitch"])
+		publisher = SpectrumPublisher(analyzer, name)
+		engine.start()
+		poll = analyzer.hop / engine.rate / 4
+		while shared[SLOT_RUNNING]:
+			engine.mic = bool(shared[SLOT_MIC])
+			engine.freeze = bool(shared[SLOT_FREEZE])
+			engine.dist = shared[SLOT_DIST]
+			engine.shift = shared[SLOT_SHIFT]
+			engine.gain = shared[SLOT_GAIN]
+			shared[SLOT_BLOCKS] = engine.blocks # heartbeat, the ui watches it to spot a stalled device
+			if analyzer.update(engine.ring, engine.shifter):
+				tracker.update(analyzer.db)
+				if tracker.active:
+					publisher.publish(analyzer.db, tracker.freq, note_equivalent(tracker.note_freq())[1], time())
+				else:
+					publisher.publish(analyzer.db, 0, "", time())
+			else:
+				sleep(poll)
+	except Exception as error: # shown in the pane, the other devices keep running
+		errors.put((index, f"{type(error).__name__}: {error}"))
+	finally:
+		if engine is not None:
+			engine.close()
+		if publisher is not None:
+			publisher.close()
+
+# one device in the monitor window: the worker handle, its frames and its own knobs
+class MonitorPane:
+	def __init__(self, index, device, process, name, shared):
+		self.index = index
+		self.device = device
+		self.process = process
+		self.name = name
+		self.shared = shared
+		self.reader = None # attached once the worker has created its ring
+		self.seq = 0
+		self.blocks = 0
+		self.heard = time() # last time the heartbeat moved
+		self.error = ""
+		self.peak_freq = 0
+		self.note = ""
+		self.active = False # the newest frame had a peak
+		self.mic_button = Button("MIC", True, idle_color=TIERTIARY_COLOR, clicked_color=MIC_BUTTON_COLOR)
+		self.freeze_button = Button("FREEZE", False, toggle=False, clicked_color=FREEZE_BUTTON_COLOR)
+		self.shift_knob = Knob(0, SHIFT_MAX, "SHIFT", SHIFT_MAX/2, percent=False)
+		self.dist_knob = Knob(1, 512, "DIST", 1)
+		self.gain_knob = Knob(0, 1.2, "GAIN", 0.8)
+		self.controls = [self.mic_button, self.freeze_button, self.shift_knob, self.dist_knob, self.gain_knob]
+		self.rect = None
+		self.axis = None
+		self.renderer = None
+		self.drawn = None # state of the last draw
+
+	def layout(self, rect):
+		self.rect = rect
+		self.bar = int(min(UNIT, rect.height // 3)) # control bar at the bottom of the pane
+		self.spectrum_h = rect.height - self.bar
+		self.surface = pygame.Surface((rect.width, self.spectrum_h))
+		self.axis = self.renderer = None
+		self.drawn = None
+
+	def poll(self, now):
+		# passes the knobs on and picks up the newest frame, returns True when there was one
+		shared = self.shared
+		shared[SLOT_MIC] = self.mic_button.value
+		shared[SLOT_FREEZE] = self.freeze_button.value
+		shared[SLOT_DIST] = self.dist_knob.value
+		shared[SLOT_SHIFT] = self.shift_knob.value
+		shared[SLOT_GAIN] = self.gain_knob.value
+		if shared[SLOT_BLOCKS] != self.blocks:
+			self.blocks = shared[SLOT_BLOCKS]
+			self.heard = now
+		if self.reader is None:
+			try:
+				self.reader = SpectrumReader(self.name, spawned=True)
+			except (FileNotFoundError, ValueError): # not created, or not filled in yet
+				return False
+		frame = self.reader.latest()
+		if frame is None or frame.seq == self.seq:
+			return False
+		self.seq = frame.seq
+		if self.renderer is None:
+			self.axis = FrequencyAxis(self.rect.width, self.reader.n_bins, max_freq=self.reader.rate / 2)
+			self.renderer = SpectrumRenderer(self.rect.width, self.spectrum_h)
+			self.levels = np.empty(self.rect.width)
+		self.axis.map(frame.spectrum, out=self.levels)
+		if not self.reader.valid(frame): # overwritten while it was read, the next one is due soon anyway
+			return False
+		levels = self.renderer.advance()
+		np.subtract(self.levels, MIN_DB, out=levels)
+		levels /= -MIN_DB
+		np.clip(levels, 0, 1, out=levels)
+		levels *= self.spectrum_h * 0.95
+		if frame.peak_freq > 0:
+			self.peak_freq, self.note = frame.peak_freq, frame.note
+		self.active = frame.peak_freq > 0
+		return True
+
+	def status(self, now):
+		if self.error:
+			return self.error
+		if not self.process.is_alive():
+			return f"STOPPED (exit code {self.process.exitcode})"
+		if now - self.heard > MONITOR_STALL:
+			return "STALLED" if self.blocks else "STARTING"
+		return ""
+
+	def state(self, now):
+		return (self.status(now), self.peak_freq, self.note, [control.state() for control in self.controls])
+
+	def draw(self, screen, solid, status):
+		rect = self.rect
+		self.surface.fill(BACKGROUND_COLOR)
+		if self.renderer is not None:
+			self.renderer.draw(self.surface, self.spectrum_h, solid=solid)
+		screen.blit(self.surface, rect.topleft)
+		active = self.active and not status
+		draw_text(screen, f"DEVICE {self.device}", FONT_SMALL, rect.x + SCALE * 10, rect.y + SCALE * 14, align="left", color=FONT_COLOR)
+		if status:
+			draw_text(screen, status, FONT_TINY, rect.x + SCALE * 10, rect.y + SCALE * 32, align="left", color=MIC_BUTTON_COLOR)
+		if self.peak_freq:
+			draw_text(screen, f"{int(self.peak_freq)} Hz {self.note}", FONT_SMALL, rect.right - SCALE * 10, rect.y + SCALE * 14, align="right", color=FONT_COLOR_ACCENT if active else TIERTIARY_COLOR)
+
+		# control bar
+		bar_y = rect.bottom - self.bar
+		pygame.draw.rect(screen, CTRL_BAR_COLOR, (rect.x, bar_y, rect.width, self.bar))
+		pygame.draw.line(screen, TIERTIARY_COLOR, (rect.x, bar_y), (rect.right - 1, bar_y), 1)
+		radius = self.bar / 3
+		gap = radius * 2.5
+		center = bar_y + self.bar / 2
+		self.mic_button.draw(screen, rect.x + self.bar / 2, center, radius)
+		self.freeze_button.draw(screen, rect.x + self.bar / 2 + gap, center, radius)
+		self.shift_knob.draw(screen, rect.right - self.bar / 2 - gap * 2, center, radius)
+		self.dist_knob.draw(screen, rect.right - self.bar / 2 - gap, center, radius)
+		self.gain_knob.draw(screen, rect.right - self.bar / 2, center, radius)
+		pygame.draw.rect(screen, TIERTIARY_COLOR, rect, 1)
+
+	def stop(self):
+		self.shared[SLOT_RUNNING] = 0
+
+	def close(self):
+		# after stop, a worker stuck on its device is terminated rather than waited on
+		self.process.join(MONITOR_JOIN)
+		if self.process.is_alive():
+			self.process.terminate()
+		if self.reader is not None:
+			self.reader.close()
+			self.reader = None
+
+def monitor_layout(n, width, height, layout):
+	# pane rects, a near square grid or one column
+	columns = 1 if layout == "stacked" else ceil(sqrt(n))
+	rows = ceil(n / columns)
+	rects = []
+	for i in range(n):
+		row, column = divmod(i, columns)
+		x0, x1 = width * column // columns, width * (column + 1) // columns
+		y0, y1 = height * row // rows, height * (row + 1) // rows
+		rects.append(pygame.Rect(x0, y0, x1 - x0, y1 - y0))
+	return rects
+
+def run_monitor(args):
+	# workers are spawned rather than forked, so none of them inherits the ui's pygame or the parent's threads
+	context = get_context("spawn")
+	environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1") # every worker imports pygame
+	settings = {"rate": args.rate, "buffer": args.buffer, "channels": args.channels, "format": args.format, "pitch": args.pitch}
+	errors = context.Queue()
+	panes = []
+	for index, device in enumerate(args.devices):
+		name = f"{SHM_NAME}-{getpid()}-{index}"
+		shared = context.RawArray("d", [1, 0, 1, SHIFT_MAX/2, 0.8, 1, 0]) # mic, freeze, dist, shift, gain, running, blocks
+		process = context.Process(target=monitor_worker, args=(index, device, settings, name, shared, errors), name=f"monitor {device}", daemon=True)
+		process.start()
+		panes.append(MonitorPane(index, device, process, name, shared))
+
+	pygame.init()
+	screen = pygame.display.set_mode((1000, 700), pygame.RESIZABLE)
+	pygame.display.set_caption(f"{TITLE} - {len(panes)} devices")
+	pygame.display.set_icon(pygame.image.load(get_icon_path()))
+	clock = pygame.time.Clock()
+	solid = False
+	full_redraw = True
+	try:
+		while True:
+			if full_redraw:
+				for pane, rect in zip(panes, monitor_layout(len(panes), *screen.get_size(), args.layout)):
+					pane.layout(rect)
+			while not errors.empty():
+				index, message = errors.get_nowait()
+				panes[index].error = message
+
+			# each pane is redrawn on its own, when it has a new frame or its status, readout or knobs changed
+			now = time()
+			dirty_rects = []
+			for pane in panes:
+				new_frame = pane.poll(now)
+				state = pane.state(now)
+				if full_redraw or new_frame or state != pane.drawn:
+					pane.drawn = state
+					pane.draw(screen, solid, state[0])
+					dirty_rects.append(pane.rect)
+			if full_redraw:
 				pygame.display.flip()
-				save_file(output_file)
-			pygame.quit()
-			sys.exit()
-		# handle window resize
-		if event.type == pygame.VIDEORESIZE: 
-			screen = pygame.display.set_mode((event.w, event.h), pygame.RESIZABLE)
-			if event.h < 400 or event.w < 650:
-				if event.h < 400: 
-					screen = pygame.display.set_mode((event.w, 400), pygame.RESIZABLE)
-				if event.w < 650: 
-					screen = pygame.display.set_mode((650, event.h), pygame.RESIZABLE)
-				if event.h < 400 and event.w < 650: 
-					screen = pygame.display.set_mode((650, 400), pygame.RESIZABLE)
-			UNIT = min(max(int(event.w/7), 95), 144)
-		# handle keybind menu toggle
-		elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and mouse_pos[0] > 0 and mouse_pos[0] < 300 and mouse_pos[1] > 0 and mouse_pos[1] < 50:
-			if show_keybinds: show_keybinds = False
-			else: show_keybinds = True
-		elif event.type == pygame.KEYDOWN:
-			if event.key == pygame.K_ESCAPE:
+			elif dirty_rects:
+				pygame.display.update(dirty_rects)
+			full_redraw = False
+			clock.tick(FPS if not ADAPTIVE_FPS or pygame.key.get_focused() else IDLE_FPS)
+
+			for event in pygame.event.get():
+				mouse_pos = pygame.mouse.get_pos()
+				for pane in panes:
+					for control in pane.controls:
+						control.handle_event(event, mouse_pos)
+				if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+					return
+				if event.type == pygame.VIDEORESIZE:
+					screen = pygame.display.set_mode((max(event.w, 400), max(event.h, 200)), pygame.RESIZABLE)
+					full_redraw = True
+				elif event.type == pygame.WINDOWEXPOSED:
+					full_redraw = True
+				elif event.type == pygame.KEYDOWN and event.key == pygame.K_v:
+					solid = not solid
+					full_redraw = True
+	finally: # every worker is told to stop first, so they wind down in parallel
+		for pane in panes:
+			pane.stop()
+		for pane in panes:
+			pane.close()
+		pygame.quit()
+
+# ---------------------------- MAIN ---------------------------- #
+# shared by the drawing code, nothing here touches the display or audio devices so importing stays side effect free
+FONT_PATH = get_font_path() # font by Google https://befonts.com/product-sans-font.html
+text_cache = TextCache()
+
+if __name__ == "__main__":
+	freeze_support()
+	stage_start = perf_counter_ns()
+	args = parse_args()
+	if args.list_devices:
+		list_devices()
+		sys.exit()
+	if args.batch is not None:
+		run_batch(args)
+		sys.exit()
+	if args.devices:
+		run_monitor(args)
+		sys.exit()
+
+	# kernels are compiled while the window opens, audio starts once they are ready
+	kernel_thread = threading.Thread(target=warm_kernels, args=(args.format,), name="warm kernels", daemon=True)
+	kernel_thread.start()
+	stage_start = startup_stage("arguments", stage_start)
+
+	pygame.init() 
+	stage_start = startup_stage("pygame init", stage_start)
+	screen = pygame.display.set_mode((800, 500), pygame.RESIZABLE)
+	pygame.display.set_caption(TITLE)
+	icon = pygame.image.load(get_icon_path()) # application icon by Icons8 https://icons8.com
+	pygame.display.set_icon(icon)
+	stage_start = startup_stage("window", stage_start)
+
+	# init variables
+	freq_axis = None
+	renderer = None
+	waterfall = None # created the first time the waterfall is shown, then kept up to date
+	show_waterfall = False
+	clock = pygame.time.Clock()
+	static_layer = None # background and title, rebuilt only on resize
+	keybind_layer = None # keybind menu overlay, rebuilt only on resize
+	controls_state = None # control bar is only redrawn when this changes
+	full_redraw = True
+	had_events = True
+	peak_freq = 0
+	peak_notename = ""
+	show_keybinds = False
+	show_profiler = False
+	profiler_layer = None # profiler overlay, rebuilt every PROFILE_REFRESH seconds while shown
+	profiler_updated = 0
+	recorder = None
+	frame_index = 0
+	out_file_name = None
+	record_dropped = 0 # blocks the last recording lost
+	record_error = None # what ended the last recording early
+
+	# init buttons and knobs
+	view_button = Button("LINE", True, pygame.K_v, alt_text="SOLID", idle_color=CTRL_CLICKED, clicked_color=CTRL_CLICKED)
+	mic_button = Button("MIC", True, pygame.K_n, idle_color=TIERTIARY_COLOR, clicked_color=MIC_BUTTON_COLOR)
+	mute_button = Button("MUTE", False, pygame.K_m, idle_color=TIERTIARY_COLOR, clicked_color=CTRL_CLICKED)
+	gain_knob = Knob(0, 1.2, "GAIN", 0.8)
+	dist_knob = Knob(1, 512, "DIST", 1)
+	freq_shift_knob = Knob(0, SHIFT_MAX, "SHIFT", SHIFT_MAX/2, percent=False)
+	record_button = Button("REC", False, pygame.K_r, idle_color=CTRL_IDLE, clicked_color=MIC_BUTTON_COLOR)
+	freeze_button = Button("FREEZE", False, pygame.K_f, toggle=False, clicked_color=FREEZE_BUTTON_COLOR)
+	controls = [view_button, mic_button, mute_button, freeze_button, record_button, freq_shift_knob, dist_knob, gain_knob]
+
+	# init audio engine (capture, effects and output run in the stream callback)
+	engine = AudioEngine(args.rate, args.buffer, args.channels, args.format, args.device, args.output_device)
+	analyzer = SpectrumAnalyzer(rate=engine.rate, channels=engine.channels)
+	peak_tracker = PeakTracker(analyzer, mode=args.pitch)
+	publisher = None
+	if args.publish or args.publish_udp or args.publish_unix:
+		publisher = SpectrumPublisher(analyzer, args.publish, ("127.0.0.1", args.publish_udp) if args.publish_udp else None, args.publish_unix)
+		if publisher.name != args.publish:
+			print(f"Shared memory '{args.publish}' is already in use, publishing to '{publisher.name}' instead")
+		publish_analyzer = SpectrumAnalyzer(rate=engine.rate, channels=engine.channels)
+		publisher.follow(engine, publish_analyzer, PeakTracker(publish_analyzer, mode=args.pitch))
+	profiler = Profiler()
+	engine.profiler = profiler
+	next_export = time() + args.profile_interval
+	startup_printed = not args.startup_profile
+	first_frame = True
+	stage_start = startup_stage("ui and engine", stage_start) # first frame and audio start are timed from here
+	frame_start = perf_counter_ns()
+
+	while True:
+		if engine.stream is None and not kernel_thread.is_alive():
+			engine.start()
+			startup_stage("audio start", stage_start)
+
+		# hand the current control state to the audio callback
+		engine.mic = mic_button.value
+		engine.mute = mute_button.value
+		engine.freeze = freeze_button.value
+		engine.dist = dist_knob.value
+		engine.shift = freq_shift_knob.value
+		engine.gain = gain_knob.value
+
+		# stft of the newest samples for spectrum visualization (dBFS)
+		profiler.mark()
+		new_frame = analyzer.update(engine.ring, engine.shifter)
+		spectrum = analyzer.db
+		if new_frame:
+			peak_tracker.update(spectrum)
+		profiler.lap("analysis", new_frame)
+
+		# visual representation of spectrum
+		info = pygame.display.Info()
+		spectrum_h_range = info.current_h - UNIT # compensate for the control bar
+		if freq_axis is None or not freq_axis.matches(info.current_w, len(spectrum), analyzer.rate / 2): # only on resize or fft size change
+			freq_axis = FrequencyAxis(info.current_w, len(spectrum), max_freq=analyzer.rate / 2)
+		if renderer is None or not renderer.matches(info.current_w, info.current_h): # decay history only reallocated on resize
+			renderer = SpectrumRenderer(info.current_w, info.current_h)
+			new_frame = True
+		freqs = freq_axis.freqs
+		if new_frame: # decay layers advance once per analysed frame, not once per ui frame
+			dp_spectrum = freq_axis.map(spectrum, out=renderer.advance()) # written straight into the decay ring
+			dp_spectrum -= MIN_DB # scales dB range to fit on screen
+			dp_spectrum /= -MIN_DB
+			np.clip(dp_spectrum, 0, 1, out=dp_spectrum)
+			dp_spectrum *= spectrum_h_range * 0.95 # prevents from touching the top of the screen
+		dp_spectrum = renderer.latest()
+		if show_waterfall and (waterfall is None or not waterfall.matches(info.current_w, int(spectrum_h_range))):
+			waterfall = Waterfall(info.current_w, int(spectrum_h_range))
+		if new_frame and waterfall is not None:
+			waterfall.push(dp_spectrum, spectrum_h_range * 0.95)
+		profiler.lap("axis", new_frame)
+
+		# recording (every processed block is streamed to disk by the recorder thread)
+		if recorder is not None and recorder.error is not None: # the writer failed, stop as if REC was turned off
+			record_button.set(False)
+		if record_button.value and recorder is None:
+			recorder = Recorder(engine.rate, engine.channels, RECORD_FORMAT or engine.sample_format)
+			recorder.start()
+			engine.recorder = recorder
+		elif not record_button.value and recorder is not None:
+			engine.recorder = None
+			frame_index = 0
+			out_file_name = recorder.stop()[-1]
+			record_dropped = recorder.dropped
+			record_error = recorder.error
+			recorder = None
+
+		# static layers only change with the window size
+		if full_redraw or static_layer is None:
+			static_layer = pygame.Surface((info.current_w, info.current_h))
+			static_layer.fill(BACKGROUND_COLOR)
+			draw_title(static_layer)
+			keybind_layer = None
+		if show_keybinds and keybind_layer is None:
+			keybind_layer = pygame.Surface((info.current_w, info.current_h), pygame.SRCALPHA)
+			draw_keybinds(keybind_layer, info)
+
+		# profiler overlay numbers only refresh a few times per second
+		profiler_due = show_profiler and (profiler_layer is None or time() - profiler_updated > PROFILE_REFRESH)
+		if profiler_due:
+			profiler_updated = time()
+			xruns = engine.total_xruns()
+			dropped = recorder.dropped if recorder is not None else record_dropped
+			failed = (recorder.error if recorder is not None else record_error) is not None
+			profiler_layer = pygame.Surface((info.current_w, info.current_h), pygame.SRCALPHA)
+			draw_profiler(profiler_layer, profiler, [
+				(f"XRUNS {xruns} (in {engine.xruns['input_overflow'] + engine.xruns['input_underflow']}, out {engine.xruns['output_overflow'] + engine.xruns['output_underflow']})", MIC_BUTTON_COLOR if xruns else FONT_COLOR),
+				(f"{engine.rate} HZ {engine.channels} CH {engine.sample_format.upper()} BLOCK {engine.buffer}", FONT_COLOR),
+				(f"FFT {analyzer.fft_size} HOP {analyzer.hop} {analyzer.avg_cost_ns / 1e6:.2f} ms", FONT_COLOR),
+				(f"TEXT CACHE {text_cache.hit_rate():.0%} HIT", FONT_COLOR),
+				(f"RECORDER {'FAILED, ' if failed else ''}DROPPED {dropped} BLOCKS", MIC_BUTTON_COLOR if dropped or failed else FONT_COLOR),
+				(f"AUDIO BLOCKS REUSED {engine.reused / max(engine.blocks, 1):.0%}", FONT_COLOR),
+				(f"{clock.get_fps():.0f} FPS", FONT_COLOR),
+			])
+
+		# ---------------------------- UI ---------------------------- #
+		# the spectrum area is redrawn when there is a new frame, an event or a fading message
+		dirty_rects = []
+		saving = out_file_name is not None and frame_index < SAVE_MESSAGE_FRAMES
+		if full_redraw or new_frame or had_events or saving or profiler_due:
+			profiler.mark()
+			spectrum_rect = pygame.Rect(0, 0, info.current_w, spectrum_h_range)
+			screen.set_clip(spectrum_rect)
+			if show_waterfall: # covers the whole static layer, the title is drawn over it
+				waterfall.draw(screen)
+				draw_title(screen)
+			else:
+				screen.blit(static_layer, (0, 0))
+				renderer.draw(screen, spectrum_h_range, solid=not view_button.value)
+			profiler.lap("spectrum")
+			if saving:
+				save_confirmation(screen, info, out_file_name, frame_index, record_dropped, record_error)
+				frame_index += 1
+
+			# mic on/off indicator
+			if mic_button.value: mode_string = "MIC ON"
+			else: mode_string = "MIC OFF"
+			mode_text = text_cache.render(mode_string, FONT_MEDIUM, FONT_COLOR)
+			screen.blit(mode_text, (info.current_w - (mode_text.get_width() + (SCALE * 10)),  (SCALE * 10)))
+
+			# only shows mouse cursor if in window
+			mouse_pos = pygame.mouse.get_pos()
+			try: 
+				if mouse_pos[1] < spectrum_h_range:
+					mouse_freq, mouse_note = note_equivalent(int(freqs[mouse_pos[0]]))
+					pygame.draw.line(screen, CH_COLOR, (mouse_pos[0], 0), (mouse_pos[0], spectrum_h_range), 1)
+					freq_text = text_cache.render(f"{mouse_freq} Hz", FONT_SMALL, FONT_COLOR)
+					screen.blit(freq_text, (max(mouse_pos[0] - freq_text.get_width() - 15, 0 + (SCALE * 10)), max(mouse_pos[1] - (SCALE * 10), SCALE * 75)))
+					note_text = text_cache.render(f"{mouse_note}", FONT_TINY, FONT_COLOR)
+					screen.blit(note_text, (max(mouse_pos[0] - note_text.get_width() - 15, 0 + (SCALE * 10)), max(mouse_pos[1] - (SCALE * 10), SCALE * 75) + freq_text.get_height()))
+			except IndexError:
+				pass
+
+			# peak freq indicator, the last pitch stays up (not highlighted) while nothing is playing
+			peak_freq_text = text_cache.render(f"{int(peak_freq)} Hz", FONT_SMALL, FONT_COLOR)
+			peak_note_text = text_cache.render(f"{peak_notename}", FONT_SMALL, FONT_COLOR)
+			if peak_tracker.active:
+				peak_freq, peak_notename = peak_tracker.freq, note_equivalent(peak_tracker.note_freq())[1]
+				peaks_text = text_cache.render("  ".join(f"{int(freq)}" for freq in peak_tracker.peak_freqs[1:]), FONT_XTINY, TIERTIARY_COLOR)
+				screen.blit(peaks_text, (info.current_w - (peaks_text.get_width() + (SCALE * 10)), (SCALE * 72)))
+				peak_freq_text = text_cache.render(f"{int(peak_freq)} Hz", FONT_SMALL, FONT_COLOR_ACCENT)
+				peak_note_text = text_cache.render(f"{peak_notename}", FONT_SMALL, FONT_COLOR_ACCENT)
+				screen.blit(peak_freq_text, (info.current_w - (peak_freq_text.get_width() + (SCALE * 10)), (SCALE * 35)))
+				screen.blit(peak_note_text, (info.current_w - (peak_note_text.get_width() + (SCALE * 10)), (SCALE * 55)))
+			else: 
+				screen.blit(peak_freq_text, (info.current_w - (peak_freq_text.get_width() + (SCALE * 10)), (SCALE * 35)))
+				screen.blit(peak_note_text, (info.current_w - (peak_note_text.get_width() + (SCALE * 10)), (SCALE * 55)))
+
+			# keybind popup and profiler overlay
+			if show_keybinds: screen.blit(keybind_layer, (0, 0))
+			if show_profiler: screen.blit(profiler_layer, (0, 0))
+			screen.set_clip(None)
+			dirty_rects.append(spectrum_rect)
+			profiler.lap("hud")
+
+		# control bar is only redrawn when a knob or button changed
+		state = (UNIT, info.current_w, info.current_h, [control.state() for control in controls])
+		if full_redraw or state != controls_state:
+			profiler.mark()
+			controls_state = state
+			pygame.draw.rect(screen, CTRL_BAR_COLOR, (0, info.current_h - UNIT, info.current_w, UNIT))
+			pygame.draw.line(screen, TIERTIARY_COLOR, (0, (info.current_h - UNIT) + 1), (info.current_w + 1, info.current_h - UNIT + 1), 2)
+
+			radius = UNIT/3
+			gap = radius*2.5
+
+			# draw buttons and knobs
+			view_button.draw(screen, UNIT/2, (info.current_h - UNIT/2), radius)
+			mic_button.draw(screen, UNIT/2 + gap, (info.current_h - UNIT/2), radius)
+			mute_button.draw(screen, UNIT/2 + gap*2, (info.current_h - UNIT/2), radius)
+			freeze_button.draw(screen, UNIT/2 + gap*3, info.current_h - UNIT/2, radius)
+			record_button.draw(screen, UNIT/2 + gap*4, info.current_h - UNIT/2, radius)
+			freq_shift_knob.draw(screen, info.current_w - UNIT/2 - gap*2, (info.current_h - UNIT/2), radius)
+			dist_knob.draw(screen, info.current_w - UNIT/2 - gap, (info.current_h - UNIT/2), radius)
+			gain_knob.draw(screen, info.current_w - UNIT/2, (info.current_h - UNIT/2), radius)
+			dirty_rects.append(pygame.Rect(0, info.current_h - UNIT, info.current_w, UNIT))
+			profiler.lap("controls")
+
+		# ---------------------------- EVENTS ---------------------------- #
+		profiler.mark()
+		if full_redraw:
+			pygame.display.flip()
+		elif dirty_rects:
+			pygame.display.update(dirty_rects)
+		profiler.lap("display", full_redraw or len(dirty_rects) > 0)
+		if first_frame:
+			first_frame = False
+			startup_stage("first frame", stage_start)
+		if not startup_printed and engine.stream is not None:
+			startup_printed = True
+			print_startup_profile()
+		full_redraw = False
+		if args.profile_export and time() >= next_export:
+			next_export = time() + args.profile_interval
+			profiler.export(args.profile_export, engine.xruns)
+		clock.tick(FPS if not ADAPTIVE_FPS or pygame.key.get_focused() else IDLE_FPS)
+		profiler.lap("idle")
+		now = perf_counter_ns()
+		profiler.record("frame", now - frame_start)
+		frame_start = now
+		events = pygame.event.get()
+		had_events = len(events) > 0
+		for event in events:
+
+			mouse_pos = pygame.mouse.get_pos()
+			gain_knob.handle_event(event, mouse_pos)
+			dist_knob.handle_event(event, mouse_pos)
+			freq_shift_knob.handle_event(event, mouse_pos)
+			mute_button.handle_event(event, mouse_pos)
+			mic_button.handle_event(event, mouse_pos)
+			view_button.handle_event(event, mouse_pos)
+			freeze_button.handle_event(event, mouse_pos)
+			record_button.handle_event(event, mouse_pos)
+
+			if event.type == pygame.QUIT:
+				engine.close()
+				if publisher is not None:
+					publisher.close()
+				if recorder is not None:
+					pygame.display.flip()
+					recorder.stop()
 				pygame.quit()
 				sys.exit()
+			# handle window resize
+			if event.type == pygame.VIDEORESIZE: 
+				screen = pygame.display.set_mode((event.w, event.h), pygame.RESIZABLE)
+				if event.h < 400 or event.w < 650:
+					if event.h < 400: 
+						screen = pygame.display.set_mode((event.w, 400), pygame.RESIZABLE)
+					if event.w < 650: 
+						screen = pygame.display.set_mode((650, event.h), pygame.RESIZABLE)
+					if event.h < 400 and event.w < 650: 
+						screen = pygame.display.set_mode((650, 400), pygame.RESIZABLE)
+				new_unit = min(max(int(event.w/7), 95), 144)
+				if new_unit != UNIT: # knob and button text sizes follow UNIT
+					text_cache.clear()
+				UNIT = new_unit
+				freq_axis = None # pixel columns changed, rebuild the bin mapping
+				renderer = None
+				waterfall = None
+				full_redraw = True
+			elif event.type == pygame.WINDOWEXPOSED:
+				full_redraw = True
+			# handle keybind menu toggle
+			elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and mouse_pos[0] > 0 and mouse_pos[0] < 300 and mouse_pos[1] > 0 and mouse_pos[1] < 50:
+				if show_keybinds: show_keybinds = False
+				else: show_keybinds = True
+			elif event.type == pygame.KEYDOWN:
+				if event.key == pygame.K_p:
+					show_profiler = not show_profiler
+					profiler_layer = None
+				if event.key == pygame.K_w:
+					show_waterfall = not show_waterfall
+				if event.key == pygame.K_ESCAPE:
+					engine.close()
+					if publisher is not None:
+						publisher.close()
+					if recorder is not None:
+						recorder.stop()
+					pygame.quit()
+					sys.exit()
+		profiler.lap("events")
 
-# ---------------------------- AUDIO CLEANUP ---------------------------- #
-mic_stream.stop_stream()
-mic_stream.close()
-p.terminate()
\ No newline at end of file
+	# ---------------------------- AUDIO CLEANUP ---------------------------- #
+	engine.close()
\ No newline at end of file